@@ -34,6 +34,12 @@ def tsh(request, engine):
 def pytest_addoption(parser):
     parser.addoption('--refresh-refs', action='store_true', default=False,
                      help='refresh reference outputs')
+    parser.addoption('--bench-out', default=None,
+                     help='json file to write the benchmark results to')
+    parser.addoption('--bench-baseline', default=None,
+                     help='json file of benchmark results to compare with')
+    parser.addoption('--bench-threshold', type=float, default=.2,
+                     help='tolerated benchmark regression ratio')
 
 
 @pytest.fixture
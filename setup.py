@@ -2,7 +2,7 @@ from setuptools import setup
 
 
 setup(name='tshistory_alias',
-      version='0.6.0',
+      version='0.7.0',
       author='Pythonian',
       author_email='arnaud.campeas@pythonian.fr, aurelien.campeas@pythonian.fr',
       description='Computed timeseries on top of the `tshistory` package',
@@ -22,7 +22,11 @@ setup(name='tshistory_alias',
           'verify-aliases=tshistory_alias.cli:verify_aliases',
           'audit-aliases=tshistory_alias.cli:audit_aliases',
           'export-aliases=tshistory_alias.cli:export_aliases',
+          'materialize-aliases=tshistory_alias.cli:materialize_aliases',
+          'profile-alias=tshistory_alias.cli:profile_alias',
+          'alias-stats=tshistory_alias.cli:alias_stats',
           'migrate-alias-0.4-to-0.5=tshistory_alias.cli:migrate_dot_four_to_dot_five',
+          'migrate-alias-0.6-to-0.7=tshistory_alias.cli:migrate_dot_six_to_dot_seven',
           'shell=tshistory_alias.cli:shell'
       ]},
       classifiers=[
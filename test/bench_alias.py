@@ -0,0 +1,175 @@
+"""Alias evaluation benchmarks
+
+They run against the same postgres cluster as the tests, but are not
+collected by default:
+
+    pytest test/bench_alias.py --bench-out bench.json
+    pytest test/bench_alias.py --bench-baseline bench.json
+
+Each scenario builds a synthetic alias catalogue, then records the
+latency, peak memory, query count and point count of reading its
+root. With a baseline file, a scenario fails when its latency or its
+query count grows by more than the threshold.
+"""
+import json
+import threading
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import time
+
+import pandas as pd
+import pytest
+from sqlalchemy import event
+
+from tshistory.testutil import genserie
+
+
+SCENARIOS = {
+    'deep': dict(depth=6, fanout=2, length=1000),
+    'wide': dict(depth=1, fanout=200, length=1000),
+    'long': dict(depth=2, fanout=3, length=100000),
+    'diamond': dict(depth=5, fanout=4, length=1000, diamond=True),
+    'bounds': dict(depth=3, fanout=3, length=2000, bounds=True),
+    'revisions': dict(depth=2, fanout=3, length=500, revisions=10),
+    'delta': dict(depth=2, fanout=3, length=500, revisions=10,
+                  delta=timedelta(hours=2))
+}
+
+RUNS = 3
+
+
+def build_catalogue(engine, tsh, prefix, depth, fanout, length,
+                    diamond=False, bounds=False, revisions=1, delta=None):
+    """Define a tree of aliases of `depth` levels of `fanout` children
+    each (alternatively priorities and arithmetics) and return the
+    name of its root
+
+    With `diamond`, all the nodes of a level share the same children.
+    """
+    leaves = set()
+    built = set()
+
+    def node(level, index):
+        if level == depth:
+            name = f'{prefix}-leaf-{index}'
+            leaves.add(name)
+            return name
+        name = f'{prefix}-{level}-{index}'
+        if name in built:
+            return name
+        built.add(name)
+        children = [
+            node(level + 1, child if diamond else index * fanout + child)
+            for child in range(fanout)
+        ]
+        if level % 2:
+            tsh.build_arithmetic(engine, name, {
+                child: 1 for child in children
+            })
+        else:
+            tsh.build_priority(engine, name, children)
+        if bounds:
+            tsh.add_bounds(engine, name, min=-1e9, max=1e9)
+        return name
+
+    root = node(0, 0)
+    for leaf in sorted(leaves):
+        for revision in range(revisions):
+            idate = pd.Timestamp(datetime(2020, 1, 1), tz='UTC') + timedelta(hours=revision)
+            tsh.insert(
+                engine,
+                genserie(idate, 'H', length, [revision], tz='UTC'),
+                leaf, 'bench',
+                insertion_date=idate
+            )
+        if bounds:
+            tsh.add_bounds(engine, leaf, min=-1e9, max=1e9)
+    return root
+
+
+class querycounter:
+    """Count the statements executed on an engine by the current
+    thread
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.local = threading.local()
+        self.count = 0
+
+    def __call__(self, *args):
+        if getattr(self.local, 'active', False):
+            self.count += 1
+
+    def __enter__(self):
+        self.count = 0
+        self.local.active = True
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        self.local.active = False
+        event.remove(self.engine, 'before_cursor_execute', self)
+
+
+@pytest.fixture(scope='module')
+def results(request):
+    out = {}
+    yield out
+    path = request.config.getoption('--bench-out')
+    if path:
+        Path(path).write_text(json.dumps(out, indent=2, sort_keys=True))
+
+
+@pytest.fixture(scope='module')
+def baseline(request):
+    path = request.config.getoption('--bench-baseline')
+    if not path:
+        return {}
+    return json.loads(Path(path).read_text())
+
+
+@pytest.mark.parametrize('scenario', sorted(SCENARIOS))
+def test_bench(engine, tsh, results, baseline, request, scenario):
+    params = SCENARIOS[scenario]
+    root = build_catalogue(engine, tsh, f'bench-{scenario}', **params)
+    kw = {'delta': params['delta']} if 'delta' in params else {}
+
+    t0 = time()
+    ts = tsh.get(engine, root, **kw)
+    cold = time() - t0
+
+    latencies = []
+    for _ in range(RUNS):
+        t0 = time()
+        tsh.get(engine, root, **kw)
+        latencies.append(time() - t0)
+
+    with querycounter(engine) as counter:
+        tsh.get(engine, root, **kw)
+
+    tracemalloc.start()
+    tsh.get(engine, root, **kw)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        'cold': cold,
+        'seconds': min(latencies),
+        'queries': counter.count,
+        'peak_kb': peak // 1024,
+        'points': len(ts)
+    }
+    results[scenario] = result
+
+    reference = baseline.get(scenario)
+    if reference is None:
+        return
+    threshold = 1 + request.config.getoption('--bench-threshold')
+    assert result['seconds'] <= reference['seconds'] * threshold, (
+        f'{scenario}: {result["seconds"]:.3f}s vs {reference["seconds"]:.3f}s'
+    )
+    assert result['queries'] <= reference['queries'] * threshold, (
+        f'{scenario}: {result["queries"]} vs {reference["queries"]} queries'
+    )
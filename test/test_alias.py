@@ -1,11 +1,15 @@
+import asyncio
+import json
+import threading
 from datetime import datetime, timedelta
 from pathlib import Path
+from time import time
 
 import pytest
 import pandas as pd
 
 from tshistory.testutil import genserie, utcdt
-from tshistory_alias.helpers import alias_table, buildtree, showtree
+from tshistory_alias.helpers import alias_table, buildtree, buildtrees, showtree
 
 
 DATADIR = Path(__file__).parent / 'data'
@@ -482,6 +486,19 @@ def test_micmac(engine, tsh, refresh):
         '    -unknown `no-such-series`'
     ]
 
+    # all at once, out of their graph
+    trees = buildtrees(engine, tsh, ['final', 'bogus2'])
+    assert trees == [
+        buildtree(engine, tsh, 'final', []),
+        buildtree(engine, tsh, 'bogus2', [])
+    ]
+    # shared subtree
+    prio1 = trees[1][('bogus2', 'priority')][0]
+    assert prio1 is trees[0][('final', 'priority')][0][
+        ('arithmetic1', 'arithmetic')][0]
+    alltrees = buildtrees(engine, tsh)
+    assert trees[0] in alltrees and trees[1] in alltrees
+
     # test .exists
 
     assert tsh.exists(engine, 'micmac1')
@@ -696,3 +713,1098 @@ def test_historical(engine, tsh):
             from_value_date=datetime(2015, 1, 1, 6),
             to_value_date=datetime(2015, 1, 1, 11))
     )
+
+
+def test_definition_cache(engine, tsh, monkeypatch):
+    # no generation check in the way of the hit counts
+    monkeypatch.setattr(tsh, 'definitions_ttl', 3600)
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'cached1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [2]), 'cached2', 'test')
+    tsh.build_arithmetic(engine, 'cachedsum', {'cached1': 1, 'cached2': 1})
+
+    tsh.get(engine, 'cachedsum')
+    hits, misses = tsh.aliascache.hits, tsh.aliascache.misses
+    ts = tsh.get(engine, 'cachedsum')
+    assert tsh.aliascache.misses == misses
+    assert tsh.aliascache.hits > hits
+    assert ts.tolist() == [3., 3., 3.]
+
+    # definition changes are seen
+    tsh.build_arithmetic(engine, 'cachedsum', {'cached1': 1, 'cached2': -1},
+                         override=True)
+    assert tsh.get(engine, 'cachedsum').tolist() == [-1., -1., -1.]
+
+    tsh.add_bounds(engine, 'cachedsum', max=-2)
+    assert len(tsh.get(engine, 'cachedsum')) == 0
+
+    tsh.remove_alias(engine, 'arithmetic', 'cachedsum')
+    assert tsh.type(engine, 'cachedsum') == 'primary'
+    assert not tsh.exists(engine, 'cachedsum')
+
+    # unknown names are not remembered as primaries
+    from tshistory_alias.tsio import timeseries
+    assert tsh.type(engine, 'cached-later') == 'primary'
+    assert 'cached-later' not in tsh.aliascache.kinds
+    timeseries().build_arithmetic(engine, 'cached-later', {'cached1': 1})
+    assert tsh.type(engine, 'cached-later') == 'arithmetic'
+    assert tsh.aliascache.kinds['cached1'] == 'primary'
+
+    # the changes of the other processes are seen at the next check
+    # of the definitions generation
+    other = timeseries()
+    assert tsh.get(engine, 'cached-later').tolist() == [1., 1., 1.]
+    other.build_arithmetic(engine, 'cached-later', {'cached1': 2}, override=True)
+    assert tsh.get(engine, 'cached-later').tolist() == [1., 1., 1.]
+    monkeypatch.setattr(tsh, 'definitions_ttl', 0)
+    assert tsh.get(engine, 'cached-later').tolist() == [2., 2., 2.]
+    other.remove_alias(engine, 'arithmetic', 'cached-later')
+    assert tsh.type(engine, 'cached-later') == 'primary'
+
+    # only the committed definitions are cached
+    with pytest.raises(ZeroDivisionError):
+        with engine.begin() as cn:
+            tsh.build_arithmetic(cn, 'cached-rollback', {'cached1': 3})
+            assert tsh.get(cn, 'cached-rollback').tolist() == [3., 3., 3.]
+            assert 'cached-rollback' not in tsh.aliascache.kinds
+            1 / 0
+    assert tsh.type(engine, 'cached-rollback') == 'primary'
+    assert not tsh.aliascache.transactions
+
+
+def test_graph(engine, tsh):
+    tsh.build_priority(engine, 'graph_prio', ['graph_a', 'graph_b'],
+                       map_prune={'graph_a': 1})
+    tsh.build_arithmetic(engine, 'graph_sum', {'graph_prio': 1, 'graph_c': -1},
+                         {'graph_c': 'ffill'})
+    tsh.add_bounds(engine, 'graph_a', min=0)
+
+    graph = tsh.graph(engine, ['graph_sum'])
+    assert graph.kinds == {
+        'graph_sum': 'arithmetic',
+        'graph_prio': 'priority'
+    }
+    assert graph.kind('graph_a') == 'primary'
+    assert graph.children('graph_sum') == ['graph_prio', 'graph_c']
+    assert graph.children('graph_prio') == ['graph_a', 'graph_b']
+    assert graph.members['graph_prio'][-1].prune == 1
+    assert graph.members['graph_sum'][1].fillopt == 'ffill'
+    assert graph.bounds == {'graph_a': (0, None)}
+    assert graph.nodes() == {
+        'graph_sum', 'graph_prio', 'graph_a', 'graph_b', 'graph_c'
+    }
+
+
+def test_shared_nodes(engine, tsh, monkeypatch):
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'shared1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [2]), 'shared2', 'test')
+    tsh.build_arithmetic(engine, 'shared_total', {'shared1': 1, 'shared2': 1})
+    tsh.build_priority(engine, 'shared_left', ['shared_total', 'shared1'])
+    tsh.build_arithmetic(engine, 'shared_right', {'shared_total': 2, 'shared2': 1})
+    tsh.build_arithmetic(engine, 'shared_top', {'shared_left': 1,
+                                                'shared_right': 1})
+
+    fetched = []
+    get_primary = tsh._get_primary
+    def spy(cn, name, **kw):
+        fetched.append(name)
+        return get_primary(cn, name, **kw)
+    monkeypatch.setattr(tsh, '_get_primary', spy)
+
+    ts = tsh.get(engine, 'shared_top')
+    assert ts.tolist() == [11., 11., 11.]
+    assert sorted(fetched) == ['shared1', 'shared2']
+
+    tsh.build_priority(engine, 'cycle_a', ['cycle_b'])
+    tsh.build_priority(engine, 'cycle_b', ['shared1', 'cycle_a'])
+    with pytest.raises(Exception) as err:
+        tsh.get(engine, 'cycle_a')
+    assert str(err.value) == 'cycle detected in cycle_a: cycle_a -> cycle_b -> cycle_a'
+
+
+def test_released_members(engine, tsh):
+    from tshistory_alias.plan import evaluation
+
+    for idx in range(5):
+        tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [idx]),
+                   f'batch{idx}', 'test')
+    tsh.build_arithmetic(engine, 'batch_left', {'batch0': 1, 'batch1': 1})
+    tsh.build_priority(engine, 'batch_right', ['batch2', 'batch3', 'batch4'])
+    tsh.build_arithmetic(engine, 'batch_top', {'batch_left': 1,
+                                               'batch_right': 1})
+
+    ev = evaluation(tsh, engine, max_workers=1)
+    ts = ev.run('batch_top', from_value_date=datetime(2010, 1, 2))
+    assert ts.tolist() == [3., 3.]
+    # the members are forgotten once combined
+    assert list(ev.memo) == [
+        ev.key('batch_top', datetime(2010, 1, 2), None)
+    ]
+    assert ev.uses == {}
+
+
+def test_parallel(engine, tsh):
+    for idx in range(4):
+        tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 4 + idx, [idx]),
+                   f'par{idx}', 'test')
+    tsh.build_priority(engine, 'par_prio', ['par0', 'par1', 'par3'],
+                       map_prune={'par1': 1})
+    tsh.build_arithmetic(engine, 'par_sum', {'par_prio': 1, 'par2': 2},
+                         {'par2': 'ffill'})
+    tsh.build_arithmetic(engine, 'par_bogus', {'par0': 1, 'par-unknown': 1})
+
+    sequential = tsh.get(engine, 'par_sum')
+    parallel = tsh.get(engine, 'par_sum', max_workers=4)
+    assert sequential.equals(parallel)
+
+    values, origins = tsh.get_priority(engine, 'par_prio')
+    assert values.tolist() == [0., 0., 0., 0., 3., 3., 3.]
+
+    with pytest.raises(Exception) as err:
+        tsh.get(engine, 'par_bogus', max_workers=4)
+    assert str(err.value) == 'par-unknown is needed to calculate par_bogus and does not exist'
+
+
+def test_aget(engine, tsh, monkeypatch):
+    from tshistory_alias import aio
+    from tshistory_alias.plan import evaluation
+    from tshistory_alias.tsio import timeseries
+
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'async1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 4, [2]), 'async2', 'test')
+    tsh.build_priority(engine, 'async_prio', ['async1', 'async2'])
+    tsh.build_arithmetic(engine, 'async_sum', {'async_prio': 1, 'async1': 1},
+                         {'async1': 'fill=0'})
+
+    loop = asyncio.new_event_loop()
+    try:
+        ts = loop.run_until_complete(tsh.aget(engine, 'async_sum'))
+        assert ts.equals(tsh.get(engine, 'async_sum'))
+
+        many = loop.run_until_complete(
+            tsh.aget_many(engine, ['async_prio', 'async2', 'async_sum'],
+                          from_value_date=datetime(2010, 1, 3))
+        )
+    finally:
+        loop.close()
+
+    assert [ts.tolist() for ts in many] == [
+        [1., 2.], [2., 2.], [2., 2.]
+    ]
+
+    # the definitions are read on the pooled asynchronous connections,
+    # and the caches and statistics are used as with get
+    atsh = timeseries()
+    atsh.definitions_ttl = 3600
+    queries = []
+    execute = aio.connection.execute
+
+    async def spyexecute(self, sql, **params):
+        queries.append(params)
+        return await execute(self, sql, **params)
+
+    connects = []
+    connect = aio.connection.connect
+
+    async def spyconnect(self):
+        connects.append(self)
+        return await connect(self)
+
+    graphs = []
+    graph = atsh.graph
+    monkeypatch.setattr(aio.connection, 'execute', spyexecute)
+    monkeypatch.setattr(aio.connection, 'connect', spyconnect)
+    monkeypatch.setattr(
+        atsh, 'graph', lambda cn, names: graphs.append(names) or graph(cn, names)
+    )
+    cache = atsh.cache_results()
+    collector = atsh.collect_stats(interval=3600)
+
+    loop = asyncio.new_event_loop()
+    try:
+        ts = loop.run_until_complete(atsh.aget(engine, 'async_sum'))
+        # the definitions generation, then the definitions
+        assert queries == [{}, {'names': ['async_sum']}]
+        assert graphs == []
+        again = loop.run_until_complete(atsh.aget(engine, 'async_sum'))
+        assert len(queries) == 2
+        assert cache.stats()['hits'] == 1
+        assert again.equals(ts)
+        assert collector.entries['async_sum'][0] == 2
+
+        # the materializations too
+        async def failing(*args):
+            raise AssertionError('not materialized')
+
+        atsh.materialization = True
+        atsh.materialize(engine, 'async_sum')
+        cache.clear()
+        monkeypatch.setattr(evaluation, 'arun', failing)
+        again = loop.run_until_complete(atsh.aget(engine, 'async_sum'))
+        assert queries[-1] == {'alias': 'async_sum'}
+        assert again.tolist() == ts.tolist()
+        # one connection, reused by the successive reads
+        assert len(connects) == 1
+    finally:
+        loop.close()
+        atsh.dematerialize(engine, 'async_sum')
+
+
+def test_wide_arithmetic(engine, tsh):
+    coefs = {}
+    for idx in range(20):
+        tsh.insert(engine, genserie(datetime(2010, 1, 1 + idx % 3), 'D', 10, [idx]),
+                   f'wide{idx}', 'test')
+        coefs[f'wide{idx}'] = idx % 2 and 1 or -1
+    tsh.build_arithmetic(engine, 'wide_sum', coefs, {'wide1': 'bfill'})
+
+    ts = tsh.get(engine, 'wide_sum')
+    # wide1 is back-filled from the 2nd, the others start on the 3rd
+    # and the ones starting on the 1st end on the 10th
+    assert ts.index[0] == pd.Timestamp('2010-01-03')
+    assert ts.index[-1] == pd.Timestamp('2010-01-10')
+    assert ts.tolist() == [10.] * 8
+
+    # streaming: same result, the members are dropped once summed
+    from tshistory_alias.plan import evaluation
+    assert tsh.get(engine, 'wide_sum', stream=True).equals(ts)
+    ev = evaluation(tsh, engine, stream=True)
+    ev.run('wide_sum')
+    assert list(ev.memo) == [ev.key('wide_sum', None, None)]
+
+    # all members filled: the sum spans the union of their indexes
+    tsh.build_arithmetic(engine, 'wide_filled', {'wide0': 1, 'wide1': 1},
+                         {'wide0': 'fill=0', 'wide1': 'ffill'})
+    ts = tsh.get(engine, 'wide_filled', stream=True)
+    assert ts.index[0] == pd.Timestamp('2010-01-02')
+    assert ts.index[-1] == pd.Timestamp('2010-01-11')
+    assert ts.tolist() == [1.] * 10
+    assert tsh.get(engine, 'wide_filled').equals(ts)
+
+
+def test_priority_kernel():
+    from tshistory_alias.combine import priority
+    from tshistory_alias.graph import prioritymember
+
+    members = [
+        prioritymember('low', None, 1),
+        prioritymember('mid', 1, 10),
+        prioritymember('high', 2, 1)
+    ]
+    series = [
+        genserie(datetime(2010, 1, 1), 'D', 6, [1]),
+        genserie(datetime(2010, 1, 2), 'D', 3, [2]),
+        genserie(datetime(2010, 1, 1), 'D', 3, [3])
+    ]
+    values, origins = priority('kernel', members, series)
+    assert origins is None
+    assert values.name == 'kernel'
+    assert values.tolist() == [3., 20., 20., 1., 1., 1.]
+
+    values, origins = priority('kernel', members, series, origins=True)
+    assert origins.dtype == 'uint8'
+    assert origins.tolist() == [2, 1, 1, 0, 0, 0]
+    assert (origins.index == values.index).all()
+
+
+def test_priority_pushdown(engine, tsh, monkeypatch):
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 30, [1]), 'push_real', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 40, [2]), 'push_fcst', 'test')
+    tsh.build_priority(engine, 'push_prio', ['push_real', 'push_fcst'])
+
+    windows = []
+    get_primary = tsh._get_primary
+    def spy(cn, name, **kw):
+        windows.append((name, kw['from_value_date'], kw['to_value_date']))
+        return get_primary(cn, name, **kw)
+    monkeypatch.setattr(tsh, '_get_primary', spy)
+
+    expected = tsh.get(engine, 'push_prio')
+    windows.clear()
+    ts = tsh.get(engine, 'push_prio', pushdown=True)
+    assert ts.equals(expected)
+    assert windows == [
+        ('push_real', None, None),
+        ('push_fcst', None, pd.Timestamp('2010-01-01')),
+        ('push_fcst', pd.Timestamp('2010-01-30'), None)
+    ]
+
+    windows.clear()
+    ts = tsh.get(engine, 'push_prio', pushdown=True,
+                 from_value_date=datetime(2010, 1, 5),
+                 to_value_date=datetime(2010, 1, 20))
+    assert ts.tolist() == [1.] * 16
+    assert windows == [
+        ('push_real', datetime(2010, 1, 5), datetime(2010, 1, 20))
+    ]
+
+    # the outliers removed from a member are filled by the next ones
+    noisy = pd.Series(
+        [1., 1., 50., 1., 1.],
+        index=pd.date_range(datetime(2010, 1, 1), periods=5, freq='D')
+    )
+    tsh.insert(engine, noisy, 'push_noisy', 'test')
+    tsh.add_bounds(engine, 'push_noisy', max=10)
+    tsh.build_priority(engine, 'push_noisy_prio', ['push_noisy', 'push_fcst'])
+    expected = tsh.get(engine, 'push_noisy_prio')
+    ts = tsh.get(engine, 'push_noisy_prio', pushdown=True)
+    assert ts.equals(expected)
+    assert ts.tolist()[:6] == [1., 1., 2., 1., 1., 2.]
+
+
+def test_arithmetic_narrowing(engine, tsh, monkeypatch):
+    tsh.insert(engine, genserie(datetime(2000, 1, 1), 'D', 3653, [1]), 'narrow_long', 'test')
+    tsh.insert(engine, genserie(datetime(2009, 12, 1), 'D', 10, [2]), 'narrow_short', 'test')
+    tsh.insert(engine, genserie(datetime(2009, 11, 1), 'D', 60, [3]), 'narrow_filled', 'test')
+    tsh.build_arithmetic(engine, 'narrow_sum', {'narrow_long': 1,
+                                                'narrow_short': 1,
+                                                'narrow_filled': 1},
+                         {'narrow_filled': 'ffill'})
+
+    windows = {}
+    get_primary = tsh._get_primary
+    def spy(cn, name, **kw):
+        windows[name] = (kw['from_value_date'], kw['to_value_date'])
+        return get_primary(cn, name, **kw)
+    monkeypatch.setattr(tsh, '_get_primary', spy)
+
+    ts = tsh.get(engine, 'narrow_sum')
+    assert ts.tolist() == [6.] * 10
+    assert ts.index[0] == pd.Timestamp('2009-12-01')
+
+    # the filled member is always read over the whole window
+    assert windows['narrow_filled'] == (None, None)
+    assert windows['narrow_long'] == (
+        pd.Timestamp('2009-12-01'), pd.Timestamp('2009-12-10')
+    )
+    assert windows['narrow_short'] == windows['narrow_long']
+    assert tsh._extents(engine, ['narrow_short', 'narrow-nope']) == {
+        'narrow_short': (pd.Timestamp('2009-12-01'), pd.Timestamp('2009-12-10')),
+        'narrow-nope': None
+    }
+
+    # a revision date disables the narrowing
+    windows.clear()
+    tsh.get(engine, 'narrow_sum', revision_date=datetime.now())
+    assert windows['narrow_long'] == (None, None)
+
+    # the windowed flags are computed once per node
+    from tshistory_alias.plan import plan
+    compiled = plan.compile(tsh, engine, 'narrow_sum')
+    assert compiled.windows == {
+        'narrow_long': False,
+        'narrow_short': False,
+        'narrow_filled': False,
+        'narrow_sum': True
+    }
+
+
+def test_flatten_arithmetic(engine, tsh):
+    from tshistory_alias.plan import plan
+
+    for name, value in (('flat_fr', 1), ('flat_de', 2), ('flat_es', 3)):
+        tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [value]), name, 'test')
+    tsh.build_arithmetic(engine, 'flat_west', {'flat_fr': 1, 'flat_es': 2})
+    tsh.build_arithmetic(engine, 'flat_europe', {'flat_west': 10, 'flat_de': 1})
+    tsh.build_arithmetic(engine, 'flat_bounded', {'flat_fr': 1})
+    tsh.add_bounds(engine, 'flat_bounded', max=100)
+    tsh.build_arithmetic(engine, 'flat_top', {'flat_europe': 0.5,
+                                              'flat_bounded': 1})
+
+    compiled = plan.compile(tsh, engine, 'flat_top')
+    assert [(term.serie, term.coefficient, term.parent)
+            for term in compiled.terms['flat_top']] == [
+        ('flat_fr', 5, 'flat_west'),
+        ('flat_es', 10, 'flat_west'),
+        ('flat_de', 0.5, 'flat_europe'),
+        ('flat_bounded', 1, 'flat_top')
+    ]
+    assert tsh.get(engine, 'flat_top').tolist() == [37.] * 3
+
+    # the terms reached through several paths are merged
+    tsh.build_arithmetic(engine, 'flat_diamond', {'flat_west': 1,
+                                                  'flat_europe': 1})
+    compiled = plan.compile(tsh, engine, 'flat_diamond')
+    assert [(term.serie, term.coefficient, term.parent)
+            for term in compiled.terms['flat_diamond']] == [
+        ('flat_fr', 11, 'flat_west'),
+        ('flat_es', 22, 'flat_west'),
+        ('flat_de', 1, 'flat_europe')
+    ]
+    assert tsh.get(engine, 'flat_diamond').tolist() == [79.] * 3
+
+    tsh.build_arithmetic(engine, 'flat_broken', {'flat_fr': 1, 'flat_nope': 1})
+    tsh.build_arithmetic(engine, 'flat_top2', {'flat_broken': 1, 'flat_de': 1})
+    with pytest.raises(Exception) as err:
+        tsh.get(engine, 'flat_top2')
+    assert str(err.value) == 'flat_nope is needed to calculate flat_broken and does not exist'
+
+
+def test_preload_bounds(engine, tsh, monkeypatch):
+    monkeypatch.setattr(tsh, 'definitions_ttl', 3600)
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 10), 'preload1', 'test')
+    tsh.add_bounds(engine, 'preload1', min=2, max=7)
+    tsh.add_bounds(engine, 'preload2', min=1)
+
+    tsh.aliascache.bounds.clear()
+    tsh.preload_bounds(engine, ['preload1', 'preload-none'])
+    assert tsh.aliascache.bounds == {
+        'preload1': (2, 7),
+        'preload-none': None
+    }
+    tsh.preload_bounds(engine)
+    assert tsh.aliascache.bounds['preload2'] == (1, None)
+
+    misses = tsh.aliascache.misses
+    assert tsh.get(engine, 'preload1').tolist() == [2., 3., 4., 5., 6., 7.]
+    assert tsh.aliascache.misses == misses
+
+
+def test_materialized(engine, tsh, monkeypatch):
+    from tshistory_alias.plan import evaluation
+    from tshistory_alias.tsio import timeseries
+
+    monkeypatch.setattr(tsh, 'materialization', True)
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 5), 'mat1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 5, [10]), 'mat2', 'test')
+    tsh.build_arithmetic(engine, 'mat-sum', {'mat1': 1, 'mat2': 1})
+    tsh.build_priority(engine, 'mat-top', ['mat-sum', 'mat1'])
+
+    with engine.begin() as cn:
+        ts = tsh.materialize(cn, 'mat-top')
+    assert ts.tolist() == [10., 11., 12., 13., 14.]
+    rows = tsh.materialized(engine)
+    assert [(row.alias, row.stale, row.points) for row in rows] == [
+        ('mat-top', False, 5)
+    ]
+
+    # served from the stored result
+    calls = []
+    evaluate = evaluation.run
+    def spy(self, *a, **kw):
+        calls.append(a)
+        return evaluate(self, *a, **kw)
+    monkeypatch.setattr(evaluation, 'run', spy)
+    assert tsh.get(
+        engine, 'mat-top',
+        from_value_date=datetime(2010, 1, 2),
+        to_value_date=datetime(2010, 1, 3)
+    ).tolist() == [11., 12.]
+    assert calls == []
+    monkeypatch.setattr(evaluation, 'run', evaluate)
+
+    # a leaf update is propagated to the transitive dependents
+    tsh.insert(engine, genserie(datetime(2010, 1, 5), 'D', 2, [20]), 'mat2', 'test')
+    assert [row.stale for row in tsh.materialized(engine)] == [False]
+    assert tsh.get(engine, 'mat-top').tolist() == [10., 11., 12., 13., 24.]
+    assert tsh.refresh_materialized(engine) == []
+
+    # and so does a definition change
+    tsh.build_arithmetic(engine, 'mat-sum', {'mat1': 2, 'mat2': 1},
+                         override=True)
+    assert [row.stale for row in tsh.materialized(engine)] == [True]
+    assert tsh.get(engine, 'mat-top').tolist() == [10., 12., 14., 16., 28.]
+
+    tsh.dematerialize(engine, 'mat-top')
+    assert tsh.materialized(engine) == []
+
+    # without the flag, the materializations are ignored
+    tsh.materialize(engine, 'mat-top')
+    monkeypatch.setattr(tsh, 'materialization', False)
+    calls.clear()
+    monkeypatch.setattr(evaluation, 'run', spy)
+    tsh.get(engine, 'mat-top')
+    assert len(calls) == 1
+    tsh.dematerialize(engine, 'mat-top')
+
+    # a definition change done elsewhere with the flag off is caught,
+    # even with a memoized version
+    monkeypatch.setattr(tsh, 'materialization', True)
+    monkeypatch.setattr(tsh, 'definitions_ttl', 3600)
+    tsh.materialize(engine, 'mat-top')
+    assert tsh.get(engine, 'mat-top').tolist() == [10., 12., 14., 16., 28.]
+    timeseries().build_arithmetic(engine, 'mat-sum', {'mat1': 1, 'mat2': 1},
+                                  override=True)
+    assert tsh.get(engine, 'mat-top').tolist() == [10., 11., 12., 13., 24.]
+    tsh.dematerialize(engine, 'mat-top')
+
+
+def test_incremental_materialized(engine, tsh, monkeypatch):
+    from tshistory_alias.plan import evaluation
+
+    monkeypatch.setattr(tsh, 'materialization', True)
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 10), 'inc1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 10, [10]), 'inc2', 'test')
+    tsh.build_arithmetic(engine, 'inc-sum', {'inc1': 1, 'inc2': 2})
+    tsh.build_priority(engine, 'inc-prune', ['inc1', 'inc2'],
+                       map_prune={'inc1': 2})
+    tsh.build_arithmetic(engine, 'inc-ffill', {'inc1': 1, 'inc2': 1},
+                         map_fillopt={'inc2': 'ffill'})
+    for alias in ('inc-sum', 'inc-prune', 'inc-ffill'):
+        tsh.materialize(engine, alias)
+
+    windows = {}
+    evaluate = evaluation.run
+    def spy(self, name, from_value_date=None, to_value_date=None):
+        windows[name] = (from_value_date, to_value_date)
+        return evaluate(self, name, from_value_date, to_value_date)
+    monkeypatch.setattr(evaluation, 'run', spy)
+
+    # an update in the middle of the history
+    tsh.insert(engine, genserie(datetime(2010, 1, 4), 'D', 2, [-1]), 'inc1', 'test')
+    assert windows['inc-sum'] == (
+        pd.Timestamp('2010-01-04'), pd.Timestamp('2010-01-05')
+    )
+    # the prune tail leaves the end open
+    assert windows['inc-prune'] == (pd.Timestamp('2010-01-02'), None)
+    # the forward filled member is read from its previous point
+    assert windows['inc-ffill'] == (
+        pd.Timestamp('2010-01-03'), pd.Timestamp('2010-01-05')
+    )
+
+    # an update at the end: the tail pruned so far shows up
+    windows.clear()
+    tsh.insert(engine, genserie(datetime(2010, 1, 11), 'D', 2, [100]), 'inc1', 'test')
+    assert windows['inc-prune'] == (pd.Timestamp('2010-01-09'), None)
+    tsh.insert(engine, genserie(datetime(2010, 1, 13), 'D', 1, [50]), 'inc2', 'test')
+    monkeypatch.setattr(evaluation, 'run', evaluate)
+
+    assert [row.stale for row in tsh.materialized(engine)
+            if row.alias.startswith('inc-')] == [False] * 3
+
+    # the points before a change are found with bounded evaluations,
+    # bypassing the caches and materializations of get
+    reads = []
+    def readspy(self, name, from_value_date=None, to_value_date=None):
+        reads.append(from_value_date)
+        return evaluate(self, name, from_value_date, to_value_date)
+    def noget(*a, **kw):
+        raise AssertionError('read through get')
+    get = tsh.get
+    monkeypatch.setattr(evaluation, 'run', readspy)
+    monkeypatch.setattr(tsh, 'get', noget)
+    assert tsh._previous(
+        engine, 'inc1', pd.Timestamp('2010-01-08'), 3
+    ) == pd.Timestamp('2010-01-05')
+    assert reads == [
+        pd.Timestamp('2010-01-07'),
+        pd.Timestamp('2010-01-06'),
+        pd.Timestamp('2010-01-04')
+    ]
+    monkeypatch.setattr(evaluation, 'run', evaluate)
+    monkeypatch.setattr(tsh, 'get', get)
+
+    # a failed patch does not fail the insert
+    def broken(*a, **kw):
+        raise RuntimeError('boom')
+    monkeypatch.setattr(tsh, '_patch_materialized', broken)
+    tsh.insert(engine, genserie(datetime(2010, 1, 14), 'D', 1, [1]), 'inc1', 'test')
+    assert [row.stale for row in tsh.materialized(engine)
+            if row.alias.startswith('inc-')] == [True] * 3
+
+    for alias in ('inc-sum', 'inc-prune', 'inc-ffill'):
+        stored = tsh.get(engine, alias)
+        computed = evaluation(tsh, engine).run(alias)
+        assert stored.equals(computed)
+        tsh.dematerialize(engine, alias)
+
+
+def test_dependents(engine, tsh):
+    tsh.build_arithmetic(engine, 'dep-sum', {'dep1': 1, 'dep2': 1})
+    tsh.build_priority(engine, 'dep-top', ['dep-sum', 'dep3'])
+    tsh.build_priority(engine, 'dep-other', ['dep1'])
+
+    assert tsh.dependents(engine, 'dep1') == [
+        'dep-other', 'dep-sum', 'dep-top'
+    ]
+    assert tsh.dependents(engine, 'dep1', transitive=False) == [
+        'dep-other', 'dep-sum'
+    ]
+    assert tsh.dependencies(engine, 'dep-top') == [
+        'dep-sum', 'dep1', 'dep2', 'dep3'
+    ]
+    assert tsh.dependencies(engine, 'dep-top', transitive=False) == [
+        'dep-sum', 'dep3'
+    ]
+
+    # a redefinition is propagated to the dependents
+    tsh.build_arithmetic(engine, 'dep-sum', {'dep1': 1, 'dep4': 1},
+                         override=True)
+    assert tsh.dependencies(engine, 'dep-top') == [
+        'dep-sum', 'dep1', 'dep3', 'dep4'
+    ]
+    assert tsh.dependents(engine, 'dep2') == []
+
+    tsh.remove_alias(engine, 'arithmetic', 'dep-sum')
+    assert tsh.dependencies(engine, 'dep-top') == ['dep-sum', 'dep3']
+    assert tsh.dependents(engine, 'dep1') == ['dep-other']
+
+    with engine.begin() as cn:
+        tsh.rebuild_dependencies(cn)
+    assert tsh.dependencies(engine, 'dep-top') == ['dep-sum', 'dep3']
+
+
+def test_revisions(engine, tsh, monkeypatch):
+    for hour in range(3):
+        tsh.insert(engine,
+                   genserie(datetime(2015, 1, 1), 'H', 3 + hour, [hour], tz='UTC'),
+                   'rev1', 'test',
+                   insertion_date=utcdt(2015, 1, 1, hour))
+    tsh.insert(engine, genserie(datetime(2015, 1, 1), 'H', 4, [10], tz='UTC'),
+               'rev2', 'test',
+               insertion_date=utcdt(2015, 1, 1, 1, 30))
+    tsh.build_arithmetic(engine, 'rev-sum', {'rev1': 1, 'rev2': 1})
+    tsh.build_priority(engine, 'rev-prio', ['rev-sum', 'rev1'])
+
+    history = tsh.get_history(engine, 'rev-prio')
+    # rev-sum does not exist before rev2
+    assert list(history) == [
+        utcdt(2015, 1, 1, 1, 30),
+        utcdt(2015, 1, 1, 2)
+    ]
+    for idate, ts in history.items():
+        assert ts.equals(tsh.get(engine, 'rev-prio', revision_date=idate))
+    assert history[utcdt(2015, 1, 1, 2)].tolist() == [12., 12., 12., 12., 2.]
+
+    calls = []
+    get_primary = tsh._get_primary
+    def spy(cn, name, **kw):
+        calls.append(name)
+        return get_primary(cn, name, **kw)
+    monkeypatch.setattr(tsh, '_get_primary', spy)
+    revisions = tsh.get_revisions(
+        engine, 'rev-prio',
+        revision_dates=[
+            utcdt(2015, 1, 1, 2),
+            utcdt(2015, 1, 1, 2, 30),
+            utcdt(2015, 1, 1, 1, 45)
+        ]
+    )
+    monkeypatch.undo()
+    # one plain read per leaf, for the version current at the first
+    # date, the others come from the histories
+    assert sorted(calls) == ['rev1', 'rev2']
+    assert list(revisions) == [
+        utcdt(2015, 1, 1, 1, 45),
+        utcdt(2015, 1, 1, 2),
+        utcdt(2015, 1, 1, 2, 30)
+    ]
+    # no leaf changed between 2:00 and 2:30
+    assert revisions[utcdt(2015, 1, 1, 2)] is revisions[utcdt(2015, 1, 1, 2, 30)]
+    assert revisions[utcdt(2015, 1, 1, 1, 45)].tolist() == [
+        11., 11., 11., 11.
+    ]
+
+
+def test_staircases(engine, tsh, monkeypatch):
+    for insertion_date in pd.date_range(start=datetime(2015, 1, 1),
+                                        end=datetime(2015, 1, 1, 6),
+                                        freq='H'):
+        ts = genserie(start=insertion_date, freq='H', repeat=7, tz='UTC')
+        tsh.insert(engine, ts, 'stair1', 'test',
+                   insertion_date=pd.Timestamp(insertion_date, tz='UTC'))
+    tsh.insert(engine, genserie(datetime(2015, 1, 1), 'H', 15, [10], tz='UTC'),
+               'stair2', 'test',
+               insertion_date=pd.Timestamp(datetime(2015, 1, 1), tz='UTC'))
+    tsh.build_arithmetic(engine, 'stair-sum', {'stair1': 1, 'stair2': 1})
+    tsh.build_priority(engine, 'stair-prio', ['stair1', 'stair2'],
+                       map_prune={'stair1': 1})
+
+    deltas = [timedelta(hours=1), timedelta(hours=2.5), timedelta(hours=4)]
+    expected = {
+        alias: {
+            delta: tsh.get(engine, alias, delta=delta)
+            for delta in deltas
+        }
+        for alias in ('stair-sum', 'stair-prio')
+    }
+
+    def nostaircase(*a, **kw):
+        raise AssertionError('no per horizon staircase read')
+    monkeypatch.setattr(tsh, 'staircase', nostaircase)
+
+    # the versions are cut for the shortest horizon
+    from tshistory.tsio import timeseries as basets
+    cuts = []
+    get_history = basets.get_history
+    def spy(self, cn, name, **kw):
+        cuts.append(kw.get('deltabefore'))
+        return get_history(self, cn, name, **kw)
+    monkeypatch.setattr(basets, 'get_history', spy)
+
+    for alias in ('stair-sum', 'stair-prio'):
+        frame = tsh.get_staircases(engine, alias, deltas)
+        assert list(frame.columns) == deltas
+        for delta in deltas:
+            assert frame[delta].dropna().equals(expected[alias][delta])
+    assert cuts == [-timedelta(hours=1)] * 4
+
+    frame = tsh.get_staircases(
+        engine, 'stair-sum', deltas,
+        from_value_date=utcdt(2015, 1, 1, 6),
+        to_value_date=utcdt(2015, 1, 1, 11)
+    )
+    assert frame[deltas[1]].dropna().equals(
+        expected['stair-sum'][deltas[1]][utcdt(2015, 1, 1, 6):utcdt(2015, 1, 1, 11)]
+    )
+
+
+def test_bulk_registration(engine, tsh):
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'bulk1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 2), 'D', 3, [2]), 'bulk2', 'test')
+
+    priorities = pd.DataFrame({
+        'alias': ['bulk-prio', 'bulk-prio', 'bulk1', None],
+        'serie': ['bulk2', 'bulk1', 'bulk2', 'bulk1'],
+        'priority': [2, 1, 1, 1],
+        'coefficient': [None, 2, None, None],
+        'prune': [1, None, None, None]
+    })
+    arithmetic = pd.DataFrame({
+        'alias': ['bulk-sum', 'bulk-sum', 'bulk-sum2'],
+        'serie': ['bulk1', 'bulk2', 'bulk-sum'],
+        'coefficient': [1, -1, 3],
+        'fillopt': [None, 'fill=0', None]
+    })
+    outliers = pd.DataFrame({
+        'serie': ['bulk2', 'bulk1'],
+        'min': [None, None],
+        'max': [10, None]
+    })
+    with engine.begin() as cn:
+        stats = tsh.register_priorities(cn, priorities)
+        assert (stats['aliases'], stats['rows'], stats['skipped']) == (
+            1, 2, ['bulk1']
+        )
+        stats = tsh.register_arithmetic(cn, arithmetic)
+        assert (stats['aliases'], stats['rows']) == (2, 3)
+        assert tsh.register_outliers(cn, outliers)['rows'] == 1
+
+    # same definitions as the one by one registration
+    tsh.build_priority(engine, 'bulk-prio-ref', ['bulk1', 'bulk2'],
+                       map_prune={'bulk2': 1}, map_coef={'bulk1': 2})
+    tsh.build_arithmetic(engine, 'bulk-sum-ref', {'bulk1': 1, 'bulk2': -1},
+                         map_fillopt={'bulk2': 'fill=0'})
+    assert tsh.get(engine, 'bulk-prio').equals(tsh.get(engine, 'bulk-prio-ref'))
+    assert tsh.get(engine, 'bulk-sum').equals(tsh.get(engine, 'bulk-sum-ref'))
+    assert tsh.dependencies(engine, 'bulk-sum2') == ['bulk-sum', 'bulk1', 'bulk2']
+    assert tsh.bounds(engine, 'bulk2') == (None, 10)
+
+    # existing aliases are skipped, unless overridden
+    with engine.begin() as cn:
+        stats = tsh.register_arithmetic(cn, arithmetic.iloc[:2])
+    assert (stats['aliases'], stats['skipped']) == (0, ['bulk-sum'])
+
+    arithmetic['coefficient'] = [1, 1, 3]
+    with engine.begin() as cn:
+        stats = tsh.register_arithmetic(cn, arithmetic, override=True)
+    assert (stats['aliases'], stats['rows'], stats['skipped']) == (2, 3, [])
+    assert tsh.get(engine, 'bulk-sum').tolist() == [1., 3., 3.]
+
+
+def test_verify(engine, tsh):
+    from tshistory_alias.helpers import verify
+
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'verif1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 4, [2]), 'verif2', 'test')
+    tsh.build_arithmetic(engine, 'verif-sum', {'verif1': 1, 'verif2': 1})
+    tsh.build_priority(engine, 'verif-top', ['verif-sum', 'verif2'])
+    tsh.build_arithmetic(engine, 'verif-bad', {'verif1': 1, 'verif-nope': 1})
+
+    report = verify(engine, tsh, ['verif-top', 'verif-bad', 'verif-sum'], jobs=2)
+    # children first
+    assert [row['name'] for row in report] == [
+        'verif-bad', 'verif-sum', 'verif-top'
+    ]
+    rows = {row['name']: row for row in report}
+    assert rows['verif-bad']['status'] == (
+        'verif-nope is needed to calculate verif-bad and does not exist'
+    )
+    assert rows['verif-bad']['points'] is None
+    assert (rows['verif-sum']['status'], rows['verif-sum']['points']) == ('ok', 3)
+    assert rows['verif-top']['kind'] == 'priority'
+    assert rows['verif-top']['points'] == 4
+    # verif-top reuses verif-sum (but reads verif2 again)
+    assert 0 < rows['verif-top']['queries'] < rows['verif-sum']['queries']
+
+
+def test_tracing(engine, tsh):
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'traced1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 4, [2]), 'traced2', 'test')
+    tsh.add_bounds(engine, 'traced2', max=10)
+    tsh.build_arithmetic(engine, 'traced-sum', {'traced1': 1, 'traced2': 1})
+    tsh.build_priority(engine, 'traced-top', ['traced-sum', 'traced2'])
+
+    with tsh.tracing(engine) as tracer:
+        ts = tsh.get(engine, 'traced-top')
+        # the reads of the other threads are not traced
+        other = threading.Thread(target=tsh.get, args=(engine, 'traced-sum'))
+        other.start()
+        other.join()
+        untraced = []
+        other = threading.Thread(target=lambda: untraced.append(tsh.tracer))
+        other.start()
+        other.join()
+        assert untraced == [None]
+        assert tsh.tracer is tracer
+    assert tsh.tracer is None
+
+    top, = tracer.roots
+    assert (top.name, top.kind, top.points) == ('traced-top', 'priority', len(ts))
+    assert top.queries > 0
+    assert [child.name for child in top.children] == ['traced2', 'traced-sum']
+    traced2, tracedsum = top.children
+    assert not traced2.cached
+    assert not tracedsum.cached
+    assert tracedsum.kind == 'arithmetic'
+    # the shared leaf is read once
+    assert {
+        (child.name, child.cached) for child in tracedsum.children
+    } == {('traced1', False), ('traced2', True)}
+
+    out = []
+    tracer.show(printer=lambda *x: out.append(''.join(x)))
+    assert out[0].startswith('* priority `traced-top` 4 points')
+    assert out[1].startswith('    * primary `traced2` 4 points')
+    assert json.loads(tracer.json())[0]['name'] == 'traced-top'
+
+
+def test_alias_stats(engine, monkeypatch):
+    from tshistory_alias import stats
+    from tshistory_alias.tsio import timeseries
+
+    tsh = timeseries()
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'stats1', 'test')
+    tsh.build_arithmetic(engine, 'stats-double', {'stats1': 2})
+    tsh.build_priority(engine, 'stats-prio', ['stats-double', 'stats1'])
+
+    collector = tsh.collect_stats(interval=3600)
+    for _ in range(3):
+        tsh.get(engine, 'stats-double')
+    tsh.get(engine, 'stats-prio')
+    tsh.get(engine, 'stats1')  # primaries are not accounted
+    assert sorted(collector.entries) == ['stats-double', 'stats-prio']
+    assert collector.entries['stats-double'][:3:2] == [3, 9]
+
+    assert tsh.flush_stats(engine) == 2
+    assert collector.entries == {}
+    tsh.get(engine, 'stats-prio')
+    assert tsh.flush_stats(engine) == 1
+
+    rows = {row.alias: row for row in tsh.alias_stats(engine)}
+    assert (rows['stats-double'].calls, rows['stats-double'].points) == (3, 3)
+    assert (rows['stats-prio'].calls, rows['stats-prio'].points) == (2, 3)
+    assert rows['stats-prio'].p95 >= 0
+    assert [row.alias for row in tsh.alias_stats(engine, by='calls', limit=1)] == [
+        'stats-double'
+    ]
+
+    # flushed when due
+    collector.interval = 0
+    tsh.get(engine, 'stats-double')
+    assert collector.entries == {}
+    rows = {row.alias: row for row in tsh.alias_stats(engine)}
+    assert rows['stats-double'].calls == 4
+
+    # a failed flush neither fails the read nor loses the entries
+    monkeypatch.setattr(stats, 'UPSERTSQL', 'insert into "{ns}".no_such_table values (1)')
+    ts = tsh.get(engine, 'stats-double')
+    assert ts.tolist() == [2, 2, 2]
+    tsh.get(engine, 'stats-double')
+    assert collector.entries['stats-double'][:3:2] == [2, 6]
+    with pytest.raises(Exception):
+        tsh.flush_stats(engine)
+    assert collector.entries['stats-double'][:3:2] == [2, 6]
+    assert sum(collector.entries['stats-double'][3]) == 2
+
+    monkeypatch.undo()
+    assert tsh.flush_stats(engine) == 1
+    rows = {row.alias: row for row in tsh.alias_stats(engine)}
+    assert rows['stats-double'].calls == 6
+    # the latency histograms of the flushes add up
+    histogram, = engine.execute(
+        f'select latencies from "{tsh.namespace}".alias_stats '
+        'where alias = %(alias)s',
+        alias='stats-double'
+    ).fetchone()
+    assert len(histogram) == stats.BUCKETS
+    assert sum(histogram) == 6
+    assert rows['stats-double'].p95 >= stats.BASE
+
+    # the last entries are flushed when stopping (as at exit)
+    collector.interval = 3600
+    tsh.get(engine, 'stats-double')
+    collector.stop()
+    assert collector.entries == {}
+    rows = {row.alias: row for row in tsh.alias_stats(engine)}
+    assert rows['stats-double'].calls == 7
+
+
+def test_stats_buckets():
+    from tshistory_alias import stats
+
+    assert stats.bucket(0) == 0
+    assert stats.bucket(stats.BASE) == 0
+    assert stats.bucket(stats.BASE * 1.1) == 1
+    assert stats.bucket(stats.BASE * stats.RATIO ** 10 * .99) == 10
+    assert stats.bucket(1e6) == stats.BUCKETS - 1
+
+
+def test_result_cache(engine, monkeypatch):
+    from tshistory_alias import cache as cachemod
+    from tshistory_alias.tsio import timeseries
+
+    tsh = timeseries()
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [1]), 'rcache1', 'test')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [2]), 'rcache2', 'test')
+    tsh.build_arithmetic(engine, 'rcache-sum', {'rcache1': 1, 'rcache2': 1})
+    tsh.build_priority(engine, 'rcache-prio', ['rcache-sum', 'rcache1'])
+
+    cache = tsh.cache_results()
+    ts = tsh.get(engine, 'rcache-prio')
+    assert ts.tolist() == [3, 3, 3]
+    assert cache.stats()['misses'] == 1
+    ts = tsh.get(engine, 'rcache-prio')
+    assert ts.tolist() == [3, 3, 3]
+    assert cache.stats()['hits'] == 1
+
+    # the cached data cannot be corrupted
+    with pytest.raises(ValueError):
+        ts.iloc[0] = 42
+    assert tsh.get(engine, 'rcache-prio').tolist() == [3, 3, 3]
+
+    # windows are distinct entries
+    ts = tsh.get(engine, 'rcache-prio', from_value_date=datetime(2010, 1, 2))
+    assert len(ts) == 2
+    assert cache.stats()['entries'] == 2
+
+    # an insert into a dependency drops the dependents
+    tsh.get(engine, 'rcache-sum')
+    tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [5]), 'rcache2', 'test')
+    assert cache.stats()['entries'] == 0
+    assert tsh.get(engine, 'rcache-prio').tolist() == [6, 6, 6]
+
+    # and so does a redefinition
+    tsh.build_arithmetic(engine, 'rcache-sum', {'rcache1': 1, 'rcache2': 2},
+                         override=True)
+    assert cache.stats()['entries'] == 0
+    assert tsh.get(engine, 'rcache-prio').tolist() == [11, 11, 11]
+
+    # bounded by the series sizes
+    size = cache.stats()['bytes']
+    cache.maxbytes = size * 2
+    tsh.get(engine, 'rcache-sum')
+    tsh.get(engine, 'rcache-prio', from_value_date=datetime(2010, 1, 2))
+    stats = cache.stats()
+    assert stats['bytes'] <= stats['maxbytes']
+    assert stats['evictions'] >= 1
+
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    assert cache.stats()['bytes'] == 0
+
+    # the too big series are left writeable
+    cache.maxbytes = 1
+    ts = tsh.get(engine, 'rcache-sum')
+    ts.iloc[0] = 42
+    assert cache.stats()['entries'] == 0
+    cache.maxbytes = 2**20
+
+    # a result computed across an insert is not stored
+    compute = tsh._compute_alias
+
+    def racing(cn, name, *args):
+        ts = compute(cn, name, *args)
+        if name == 'rcache-sum':
+            tsh.insert(engine, genserie(datetime(2010, 1, 1), 'D', 3, [3]),
+                       'rcache1', 'test')
+        return ts
+
+    monkeypatch.setattr(tsh, '_compute_alias', racing)
+    assert tsh.get(engine, 'rcache-sum').tolist() == [11, 11, 11]
+    monkeypatch.undo()
+    assert cache.stats()['entries'] == 0
+    assert tsh.get(engine, 'rcache-sum').tolist() == [13, 13, 13]
+    assert cache.stats()['entries'] == 1
+
+    # the entries expire (the writes of the other processes are not seen)
+    now = time()
+    monkeypatch.setattr(cachemod, 'time', lambda: now + cache.ttl + 1)
+    assert tsh.get(engine, 'rcache-sum').tolist() == [13, 13, 13]
+    assert cache.stats()['expirations'] == 1
+    monkeypatch.undo()
+
+    # the definition changes of the other processes are seen
+    tsh.definitions_ttl = 0
+    timeseries().build_arithmetic(engine, 'rcache-sum', {'rcache1': 1, 'rcache2': 1},
+                                  override=True)
+    assert tsh.get(engine, 'rcache-sum').tolist() == [8, 8, 8]
+
+
+def test_file_cache(engine, tmp_path, monkeypatch):
+    from tshistory_alias.tsio import timeseries
+
+    tsh1 = timeseries()
+    tsh2 = timeseries()
+    tsh1.insert(engine, genserie(utcdt(2010, 1, 1), 'D', 3, [1]), 'fcache1', 'test')
+    tsh1.build_arithmetic(engine, 'fcache-double', {'fcache1': 2})
+
+    cache1 = tsh1.cache_files(tmp_path)
+    cache2 = tsh2.cache_files(tmp_path)
+    ts = tsh1.get(engine, 'fcache-double')
+    assert ts.tolist() == [2, 2, 2]
+    assert cache1.stats()['misses'] == 1
+    assert cache1.stats()['entries'] == 1
+    assert len(list(tmp_path.glob('*.entry'))) == 1
+
+    # the other worker maps the same files
+    ts = tsh2.get(engine, 'fcache-double')
+    assert cache2.stats()['hits'] == 1
+    assert_df("""
+2010-01-01 00:00:00+00:00    2.0
+2010-01-02 00:00:00+00:00    2.0
+2010-01-03 00:00:00+00:00    2.0
+""", ts)
+    with pytest.raises(ValueError):
+        ts.iloc[0] = 42
+    assert not list(tmp_path.glob('*.tmp'))
+
+    # an insert from any worker drops the entry for all
+    tsh1.insert(engine, genserie(utcdt(2010, 1, 1), 'D', 3, [3]), 'fcache1', 'test')
+    assert cache2.stats()['entries'] == 0
+    assert tsh2.get(engine, 'fcache-double').tolist() == [6, 6, 6]
+
+    # a damaged entry is a miss
+    entry, = tmp_path.glob('*.entry')
+    entry.write_bytes(entry.read_bytes()[:-4])
+    misses = cache1.stats()['misses']
+    assert tsh1.get(engine, 'fcache-double').tolist() == [6, 6, 6]
+    assert cache1.stats()['misses'] == misses + 1
+
+    # a result computed across an insert of another worker is not stored
+    compute = tsh1._compute_alias
+
+    def racing(*args):
+        ts = compute(*args)
+        tsh2.insert(engine, genserie(utcdt(2010, 1, 1), 'D', 3, [4]), 'fcache1', 'test')
+        return ts
+
+    monkeypatch.setattr(tsh1, '_compute_alias', racing)
+    cache1.clear()
+    assert tsh1.get(engine, 'fcache-double').tolist() == [6, 6, 6]
+    monkeypatch.undo()
+    assert cache1.stats()['entries'] == 0
+    assert tsh1.get(engine, 'fcache-double').tolist() == [8, 8, 8]
+    assert cache1.stats()['entries'] == 1
+
+    # bounded by the size on disk
+    size = cache2.stats()['bytes']
+    cache2.maxbytes = size * 2
+    for day in (2, 3):
+        tsh2.get(engine, 'fcache-double', from_value_date=utcdt(2010, 1, day))
+    stats = cache2.stats()
+    assert stats['bytes'] <= stats['maxbytes']
+    assert stats['evictions'] == 1
+    assert stats['entries'] == 2
+
+    cache1.clear()
+    assert cache2.stats()['entries'] == 0
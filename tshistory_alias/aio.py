@@ -0,0 +1,122 @@
+import asyncio
+import weakref
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.extras import NamedTupleCursor
+
+
+async def wait(conn):
+    """Await the completion of the pending operation of an
+    asynchronous psycopg2 connection
+    """
+    loop = asyncio.get_running_loop()
+    fd = conn.fileno()
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            return
+        ready = loop.create_future()
+
+        def wakeup():
+            if not ready.done():
+                ready.set_result(None)
+
+        if state == extensions.POLL_READ:
+            loop.add_reader(fd, wakeup)
+            remove = loop.remove_reader
+        elif state == extensions.POLL_WRITE:
+            loop.add_writer(fd, wakeup)
+            remove = loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f'bad poll state: {state}')
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+
+class connection:
+    """Asynchronous connection to the database of an engine, opened
+    on first use (psycopg2 asynchronous mode, thus without
+    transactions: for reads only)
+
+    The rows have attributes, as those of the engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.conn = None
+
+    async def connect(self):
+        url = self.engine.url
+        args = url.translate_connect_args(database='dbname', username='user')
+        args.update(url.query)
+        conn = psycopg2.connect(async_=1, **args)
+        try:
+            await wait(conn)
+        except BaseException:
+            conn.close()
+            raise
+        self.conn = conn
+
+    async def execute(self, sql, **params):
+        if self.conn is None:
+            await self.connect()
+        cursor = self.conn.cursor(cursor_factory=NamedTupleCursor)
+        try:
+            cursor.execute(sql, params)
+            await wait(self.conn)
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class pool:
+    """Bounded pool of the asynchronous connections to the database of
+    an engine, for one event loop
+
+    Each `execute` borrows an idle connection (or opens one) for the
+    time of its query; at most `size` queries run at once.
+    """
+
+    def __init__(self, engine, size):
+        self.engine = engine
+        self.size = size
+        self.idle = []
+        self.slots = asyncio.Semaphore(size)
+
+    async def execute(self, sql, **params):
+        async with self.slots:
+            conn = self.idle.pop() if self.idle else connection(self.engine)
+            try:
+                rows = await conn.execute(sql, **params)
+            except BaseException:
+                # possibly interrupted within its query
+                conn.close()
+                raise
+            self.idle.append(conn)
+            return rows
+
+    def close(self):
+        while self.idle:
+            self.idle.pop().close()
+
+
+# event loop -> {engine: pool}
+_pools = weakref.WeakKeyDictionary()
+
+
+def pooled(engine, size):
+    """The connection pool of `engine` for the running event loop
+    (created with `size` connections at most)
+    """
+    pools = _pools.setdefault(asyncio.get_running_loop(), {})
+    if engine not in pools:
+        pools[engine] = pool(engine, size)
+    return pools[engine]
@@ -0,0 +1,405 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from pathlib import Path
+from time import time
+
+import numpy as np
+import pandas as pd
+
+
+class definitioncache:
+    """In-process memo of the alias definitions
+
+    It remembers, per series name, its kind (`priority`, `arithmetic`
+    or `primary`), the member rows of the aliases and the outlier
+    bounds. The definition-changing methods of the alias `timeseries`
+    drop the entries they touch; the changes done by the other
+    processes are seen through the definitions generation of the
+    namespace (see `seen`).
+
+    Only committed definitions are stored: a value loaded before an
+    `invalidate` or `clear` (see `epoch`), or while a transaction
+    changing the definitions is open, is not kept.
+    """
+
+    def __init__(self):
+        self.kinds = {}
+        self.members = {}
+        self.bounds = {}
+        # definition versions (see plan.version)
+        self.versions = {}
+        # storage tables of the primary series (see timeseries._tables)
+        self.tables = {}
+        # definitions generation of the entries, and time of its check
+        self.generation = None
+        self.checked = 0
+        # bumped by invalidate and clear
+        self.epoch = 0
+        # connections with uncommitted definition changes
+        self.transactions = weakref.WeakSet()
+        self.hits = 0
+        self.misses = 0
+
+    def storable(self, epoch):
+        """Tell if values loaded since `epoch` can be stored"""
+        return epoch == self.epoch and not self.transactions
+
+    def lookup(self, store, name, loader):
+        try:
+            value = store[name]
+        except KeyError:
+            self.misses += 1
+            epoch = self.epoch
+            value = loader()
+            if self.storable(epoch):
+                store[name] = value
+            return value
+        self.hits += 1
+        return value
+
+    def seen(self, generation):
+        """Account for the current definitions generation of the
+        namespace: the entries of another generation are dropped
+        """
+        self.checked = time()
+        if generation != self.generation:
+            self.clear()
+            self.generation = generation
+
+    def invalidate(self, name):
+        self.epoch += 1
+        self.kinds.pop(name, None)
+        self.members.pop(name, None)
+        self.bounds.pop(name, None)
+        self.versions.pop(name, None)
+
+    def clear(self):
+        self.epoch += 1
+        self.kinds.clear()
+        self.members.clear()
+        self.bounds.clear()
+        self.versions.clear()
+        self.tables.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'kinds': len(self.kinds),
+            'members': len(self.members),
+            'bounds': len(self.bounds),
+            'versions': len(self.versions),
+            'tables': len(self.tables)
+        }
+
+
+class resultcache:
+    """Thread-safe LRU cache of computed alias series, bounded by the
+    memory size of the series
+
+    The keys start with the alias name, so that `invalidate` can drop
+    all the entries of an alias. The series are kept (and served)
+    with read-only values: callers get shallow copies and cannot
+    corrupt the cached data.
+
+    A result computed while its alias was invalidated is not stored
+    (see `generation`); the entries older than `ttl` seconds are
+    dropped, which bounds the staleness due to the writes of the
+    other processes.
+    """
+
+    def __init__(self, maxbytes, ttl=None):
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.bynames = {}
+        # invalidation counts per name, and of the whole cache
+        self.generations = {}
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def generation(self, name):
+        """Invalidation state of `name`, to be taken before computing
+        its series and given to `put`
+        """
+        with self.lock:
+            return self.epoch, self.generations.get(name, 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if (entry is not None and self.ttl is not None and
+                time() - entry[2] > self.ttl):
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return entry[0].copy(deep=False)
+
+    def put(self, key, ts, generation=None):
+        """Store a series (its values become read-only) and return a
+        shallow copy of it
+
+        Nothing is stored if the alias was invalidated since
+        `generation` was taken.
+        """
+        size = int(ts.memory_usage(index=True, deep=True))
+        if size > self.maxbytes:
+            return ts
+        with self.lock:
+            if (generation is not None and generation !=
+                (self.epoch, self.generations.get(key[0], 0))):
+                return ts
+            ts.values.flags.writeable = False
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[key] = (ts, size, time())
+            self.bynames.setdefault(key[0], set()).add(key)
+            self.nbytes += size
+            while self.nbytes > self.maxbytes:
+                self._drop(next(iter(self.entries)))
+                self.evictions += 1
+        return ts.copy(deep=False)
+
+    def _drop(self, key):
+        _, size, _ = self.entries.pop(key)
+        self.nbytes -= size
+        keys = self.bynames[key[0]]
+        keys.discard(key)
+        if not keys:
+            del self.bynames[key[0]]
+
+    def invalidate(self, names):
+        with self.lock:
+            for name in names:
+                self.generations[name] = self.generations.get(name, 0) + 1
+                for key in list(self.bynames.get(name, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self.lock:
+            self.epoch += 1
+            self.entries.clear()
+            self.bynames.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        calls = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'maxbytes': self.maxbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'hitrate': self.hits / calls if calls else None
+        }
+
+
+class filecache:
+    """Host-wide LRU cache of computed alias series, stored as
+    memory-mapped files in a local directory and bounded by their
+    total size on disk
+
+    An entry is a single file named after the digests of the alias
+    name and of the key: a json header line, then the raw index and
+    values arrays. It is written to a temporary file and renamed, so
+    that concurrent readers never see partial or mixed entries. The
+    series are loaded zero-copy (read-only values mapped from the
+    file), thus the processes of a host share the pages of the hot
+    aliases.
+
+    Each alias has a generation marker file, rewritten by
+    `invalidate`: it is part of the entry names, and a result
+    computed across an invalidation is not published. Only the
+    invalidations done by the processes of the host using the same
+    directory are seen.
+    """
+
+    def __init__(self, directory, maxbytes):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _digest(thing):
+        return hashlib.sha1(repr(thing).encode('utf-8')).hexdigest()
+
+    def _path(self, key, generation):
+        return self.directory / (
+            f'{self._digest(key[0])}-{self._digest((key, generation))}.entry'
+        )
+
+    def _marker(self, name):
+        return self.directory / f'{self._digest(name)}.gen'
+
+    def generation(self, name):
+        """Invalidation state of `name` (and of the whole cache), to
+        be taken before computing its series and given to `get` and
+        `put`
+        """
+        state = []
+        for marker in (self.directory / 'cache.gen', self._marker(name)):
+            try:
+                state.append(marker.read_text())
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def _bump(self, marker):
+        self._write(marker, lambda out: out.write(uuid.uuid4().hex.encode()))
+
+    def get(self, key, generation):
+        ts = self._load(self._path(key, generation))
+        if ts is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return ts
+
+    def _load(self, path):
+        try:
+            with path.open('rb') as entry:
+                line = entry.readline()
+            meta = json.loads(line)
+            length = meta['length']
+            index = np.memmap(
+                path, dtype='<i8', mode='r', offset=len(line), shape=(length,)
+            )
+            values = np.memmap(
+                path, dtype=meta['dtype'], mode='r',
+                offset=len(line) + index.nbytes, shape=(length,)
+            )
+            index = pd.DatetimeIndex(index.view('datetime64[ns]'))
+            if meta['tz'] is not None:
+                index = index.tz_localize('UTC').tz_convert(meta['tz'])
+            ts = pd.Series(values, index=index, name=meta['name'], copy=False)
+            # refresh the lru position
+            os.utime(path)
+        except (FileNotFoundError, ValueError, KeyError, TypeError):
+            return None
+        return ts
+
+    def _write(self, path, writer):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                writer(out)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _serialize(out, ts, tz):
+        header = json.dumps({
+            'name': ts.name,
+            'tz': tz,
+            'dtype': ts.values.dtype.str,
+            'length': len(ts)
+        }).encode('utf-8')
+        # the arrays start at an aligned offset
+        header += b' ' * (-(len(header) + 1) % 64) + b'\n'
+        out.write(header)
+        out.write(np.ascontiguousarray(ts.index.asi8, dtype='<i8').tobytes())
+        out.write(np.ascontiguousarray(ts.values).tobytes())
+
+    def put(self, key, ts, generation):
+        """Store a series and return its memory-mapped version (or
+        the series itself when it cannot be stored)
+
+        Nothing is stored if the alias was invalidated since
+        `generation` was taken.
+        """
+        if (not len(ts) or ts.dtype == 'O' or
+            not isinstance(ts.index, pd.DatetimeIndex)):
+            return ts
+        tz = str(ts.index.tz) if ts.index.tz is not None else None
+        size = ts.index.asi8.nbytes + ts.values.nbytes
+        if size > self.maxbytes:
+            return ts
+        if self.generation(key[0]) != generation:
+            return ts
+        path = self._path(key, generation)
+        self._write(path, lambda out: self._serialize(out, ts, tz))
+        if self.generation(key[0]) != generation:
+            # invalidated while publishing: the marker being written
+            # before the removal, either pass drops the entry
+            self._remove(path)
+            return ts
+        self._evict()
+        mapped = self._load(path)
+        return ts if mapped is None else mapped
+
+    def _entries(self):
+        """List the entries as (access time, size, path), oldest first"""
+        entries = []
+        for path in self.directory.glob('*.entry'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.maxbytes:
+                break
+            self._remove(path)
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, names):
+        for name in names:
+            # first, so that the results being computed are not published
+            self._bump(self._marker(name))
+            for path in self.directory.glob(f'{self._digest(name)}-*.entry'):
+                self._remove(path)
+
+    def clear(self):
+        self._bump(self.directory / 'cache.gen')
+        for _, _, path in self._entries():
+            self._remove(path)
+
+    def stats(self):
+        entries = self._entries()
+        calls = self.hits + self.misses
+        return {
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'maxbytes': self.maxbytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hitrate': self.hits / calls if calls else None
+        }
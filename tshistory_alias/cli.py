@@ -1,3 +1,5 @@
+import json
+import tracemalloc
 from pathlib import Path
 from collections import defaultdict
 
@@ -9,6 +11,13 @@ from tshistory.util import find_dburi
 from tshistory_alias import db, tsio, helpers
 
 
+def _report(kind, stats):
+    for alias in stats.get('skipped', ()):
+        print(f'{alias} already exists, skipped')
+    aliases = f'{stats["aliases"]} aliases, ' if 'aliases' in stats else ''
+    print(f'{kind}: {aliases}{stats["rows"]} rows in {stats["seconds"]:.2f}s')
+
+
 @click.command(name='register-priorities')
 @click.argument('dburi')
 @click.argument('priority-file')
@@ -17,7 +26,8 @@ def register_priorities(dburi, priority_file, override=False):
     " register priorities timeseries aliases "
     engine = create_engine(find_dburi(dburi))
     with engine.begin() as cn:
-        db.register_priority(cn, priority_file, override)
+        stats = db.register_priority(cn, priority_file, override)
+    _report('priorities', stats)
 
 
 @click.command(name='register-arithmetic')
@@ -28,7 +38,8 @@ def register_arithmetic(dburi, arithmetic_file, override):
     " register arithmetic timeseries aliases "
     engine = create_engine(find_dburi(dburi))
     with engine.begin() as cn:
-        db.register_arithmetic(cn, arithmetic_file, override)
+        stats = db.register_arithmetic(cn, arithmetic_file, override)
+    _report('arithmetic', stats)
 
 
 @click.command(name='register-outliers')
@@ -39,7 +50,8 @@ def register_outliers(dburi, outliers_file, override):
     " register outlier definitions "
     engine = create_engine(find_dburi(dburi))
     with engine.begin() as cn:
-        db.register_outliers(cn, outliers_file, override)
+        stats = db.register_outliers(cn, outliers_file, override)
+    _report('outliers', stats)
 
 
 @click.command(name='remove-alias')
@@ -50,10 +62,9 @@ def register_outliers(dburi, outliers_file, override):
 def remove_alias(dburi, alias_type, alias, namespace='tsh'):
     "remove singe alias"
     engine = create_engine(find_dburi(dburi))
-    table = '"{}-alias".{}'.format(namespace, alias_type)
-    sql = "delete from {} where alias = %(alias)s".format(table)
+    tsh = tsio.timeseries(namespace=namespace)
     with engine.begin() as cn:
-        cn.execute(sql, alias=alias)
+        tsh.remove_alias(cn, alias_type, alias)
 
 
 TABLES = ('outliers', 'priority', 'arithmetic')
@@ -70,18 +81,9 @@ def reset_aliases(dburi, only=None, namespace='tsh'):
         tables = [only]
 
     engine = create_engine(find_dburi(dburi))
-    for table in tables:
-        with engine.begin() as cn:
-            cn.execute(f'delete from "{namespace}-alias"."{table}"')
-
-
-def _alias_kind(engine, namespace, alias):
-    for kind in ('priority', 'arithmetic'):
-        sql = (f'select exists(select id from "{namespace}-alias".{kind} '
-               '               where alias = %(alias)s)')
-        if engine.execute(sql, alias=alias).scalar():
-            return kind
-    return None
+    tsh = tsio.timeseries(namespace=namespace)
+    with engine.begin() as cn:
+        tsh.reset_aliases(cn, tables)
 
 
 @click.command(name='audit-aliases')
@@ -91,23 +93,16 @@ def _alias_kind(engine, namespace, alias):
 def audit_aliases(dburi, alias=None, namespace='tsh'):
     " perform a visual audit of aliases "
     engine = create_engine(find_dburi(dburi))
+    tsh = tsio.timeseries(namespace=namespace)
 
-    aliases = []
+    aliases = None
     if alias:
         # verify
-        if _alias_kind(engine, namespace, alias) is not None:
+        aliases = []
+        if tsh.type(engine, alias) in tsh.alias_types:
             aliases.append(alias)
-    else:
-        for kind in ('priority', 'arithmetic'):
-            aliases += [alias for alias, in engine.execute(
-                f'select distinct alias from "{namespace}-alias".{kind}').fetchall()
-            ]
-    tsh = tsio.timeseries(namespace=namespace)
 
-    trees = []
-
-    for idx, alias in enumerate(aliases):
-        trees.append(helpers.buildtree(engine, tsh, alias, []))
+    trees = helpers.buildtrees(engine, tsh, aliases)
 
     # now, display shit
     for tree in trees:
@@ -123,9 +118,7 @@ def export_aliases(dburi, aliases, namespace='tsh'):
     engine = create_engine(find_dburi(dburi))
     tsh = tsio.timeseries(namespace=namespace)
 
-    trees = []
-    for alias in aliases:
-        trees.append(helpers.buildtree(engine, tsh, alias, []))
+    trees = helpers.buildtrees(engine, tsh, aliases)
 
     data = {
         'primary': set(),
@@ -142,6 +135,9 @@ def export_aliases(dburi, aliases, namespace='tsh'):
             return
 
         for (alias, kind), subtrees in tree.items():
+            if alias in data[kind]:
+                # shared subtree, already collected
+                continue
             data[kind].add(alias)
             for subtree in subtrees:
                 collect(subtree)
@@ -153,36 +149,28 @@ def export_aliases(dburi, aliases, namespace='tsh'):
         '\n'.join(data['primary']).encode('utf-8')
     )
 
-    arith = []
-    for name in data['arithmetic']:
-        out = engine.execute(
-            f'select alias, serie, coefficient, fillopt '
-            f'from "{namespace}-alias".arithmetic '
-            f'where alias = %(name)s '
-            f'order by alias',
-            name=name
-        ).fetchall()
-        arith.extend(dict(row) for row in out)
-
-    df = pd.DataFrame(arith)
+    arith = engine.execute(
+        f'select alias, serie, coefficient, fillopt '
+        f'from "{namespace}".arithmetic '
+        f'where alias = any(%(names)s::text[]) '
+        f'order by alias, id',
+        names=list(data['arithmetic'])
+    ).fetchall()
+    df = pd.DataFrame([dict(row) for row in arith])
     df.to_csv(
         Path('arith.csv'),
         columns=('alias', 'serie', 'coefficient', 'fillopt'),
         index=False
     )
 
-    prio = []
-    for name in data['priority']:
-        out = engine.execute(
-            f'select alias, serie, priority, coefficient, prune '
-            f'from "{namespace}-alias".priority '
-            f'where alias = %(name)s '
-            f'order by alias, priority asc',
-            name=name
-        ).fetchall()
-        prio.extend(dict(row) for row in out)
-
-    df = pd.DataFrame(prio)
+    prio = engine.execute(
+        f'select alias, serie, priority, coefficient, prune '
+        f'from "{namespace}".priority '
+        f'where alias = any(%(names)s::text[]) '
+        f'order by alias, priority asc',
+        names=list(data['priority'])
+    ).fetchall()
+    df = pd.DataFrame([dict(row) for row in prio])
     df.to_csv(
         Path('prio.csv'),
         columns=('alias', 'serie', 'priority', 'coefficient', 'prune'),
@@ -193,32 +181,131 @@ def export_aliases(dburi, aliases, namespace='tsh'):
 @click.command(name='verify-aliases')
 @click.argument('dburi')
 @click.option('--only', type=click.Choice(TABLES))
+@click.option('--jobs', type=int, default=1, help='number of threads')
+@click.option('--format', 'fmt', type=click.Choice(('text', 'csv', 'json')),
+              default='text')
+@click.option('--output', help='report file (stdout by default)')
 @click.option('--namespace', default='tsh')
-def verify_aliases(dburi, only=None, namespace='tsh'):
-    " verify aliases wholesale (all or per type using --only) "
+def verify_aliases(dburi, only=None, jobs=1, fmt='text', output=None,
+                   namespace='tsh'):
+    """ verify aliases wholesale (all or per type using --only)
+    and report their latency, point and query counts
+    """
     if only is None:
         tables = TABLES
     else:
         assert only in TABLES
         tables = [only]
 
-    engine = create_engine(find_dburi(dburi))
+    engine = create_engine(
+        find_dburi(dburi), pool_size=max(jobs, 5)
+    )
     tsh = tsio.timeseries(namespace=namespace)
+    names = []
     for table in tables:
         colname = 'serie' if table == 'outliers' else 'alias'
         for row in engine.execute(
-                f'select distinct {colname} from "{namespace}-alias"."{table}"'
+                f'select distinct {colname} from "{namespace}"."{table}"'
         ).fetchall():
-            name = row[0]
-            try:
-                series = tsh.get(engine, name)
-            except tsio.AliasError as err:
-                print(err)
-            else:
-                if not series.index.is_monotonic_increasing:
-                    print(name, 'is non monotonic')
+            if row[0] not in names:
+                names.append(row[0])
+
+    report = helpers.verify(engine, tsh, names, jobs)
+    if fmt == 'text':
+        out = '\n'.join(
+            f'{row["name"]} {row["points"]} {row["status"]} '
+            f'{row["seconds"]:.3f}s {row["queries"]} queries'
+            for row in report
+        )
+    elif fmt == 'csv':
+        out = pd.DataFrame(
+            report,
+            columns=['name', 'kind', 'seconds', 'points', 'queries', 'status']
+        ).to_csv(index=False)
+    else:
+        out = json.dumps(report, indent=2)
 
-            print(name, len(series))
+    if output is None:
+        print(out)
+    else:
+        Path(output).write_text(out)
+
+
+@click.command(name='profile-alias')
+@click.argument('dburi')
+@click.argument('name')
+@click.option('--json', 'asjson', is_flag=True, default=False,
+              help='json output')
+@click.option('--memory', is_flag=True, default=False,
+              help='also measure the memory (slower)')
+@click.option('--namespace', default='tsh')
+def profile_alias(dburi, name, asjson=False, memory=False, namespace='tsh'):
+    " show the evaluation profile of a series, node by node "
+    engine = create_engine(find_dburi(dburi))
+    tsh = tsio.timeseries(namespace=namespace)
+    if memory:
+        tracemalloc.start()
+    try:
+        with tsh.tracing(engine) as tracer:
+            tsh.get(engine, name)
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    if asjson:
+        print(tracer.json())
+    else:
+        tracer.show()
+
+
+@click.command(name='alias-stats')
+@click.argument('dburi')
+@click.option('--by', type=click.Choice(('calls', 'seconds', 'p95', 'mean', 'points')),
+              default='calls',
+              help='ranking statistic (calls: hottest, seconds: costliest)')
+@click.option('--limit', type=int, default=20)
+@click.option('--namespace', default='tsh')
+def alias_stats(dburi, by='calls', limit=20, namespace='tsh'):
+    " list the most read or most expensive aliases "
+    engine = create_engine(find_dburi(dburi))
+    tsh = tsio.timeseries(namespace=namespace)
+    print('alias calls seconds mean p95 points updated')
+    for row in tsh.alias_stats(engine, by, limit):
+        print(row.alias, row.calls,
+              f'{row.seconds:.3f}', f'{row.mean:.4f}',
+              f'{row.p95:.4f}' if row.p95 is not None else '-',
+              row.points, row.updated)
+
+
+@click.command(name='materialize-aliases')
+@click.argument('dburi')
+@click.argument('action', type=click.Choice(('list', 'add', 'refresh', 'drop')))
+@click.argument('aliases', nargs=-1)
+@click.option('--namespace', default='tsh')
+def materialize_aliases(dburi, action, aliases, namespace='tsh'):
+    """ list, add, refresh (the given or all the stale ones) or drop
+    materialized aliases
+    """
+    engine = create_engine(find_dburi(dburi))
+    tsh = tsio.timeseries(namespace=namespace)
+    tsh.materialization = True
+    with engine.begin() as cn:
+        if action == 'list':
+            for row in tsh.materialized(cn):
+                print(row.alias, row.points,
+                      'stale' if row.stale else 'fresh',
+                      row.computed)
+        elif action == 'add':
+            for alias in aliases:
+                ts = tsh.materialize(cn, alias)
+                print(alias, len(ts))
+        elif action == 'refresh':
+            for alias in tsh.refresh_materialized(cn, aliases or None):
+                print('refreshed', alias)
+        else:
+            for alias in aliases:
+                tsh.dematerialize(cn, alias)
+                print('dropped', alias)
 
 
 @click.command(name='migrate-alias-0.4-to-0.5')
@@ -235,6 +322,62 @@ def migrate_dot_four_to_dot_five(dburi, namespace='tsh'):
         cn.execute(f'drop schema "{namespace}-alias"')
 
 
+@click.command(name='migrate-alias-0.6-to-0.7')
+@click.argument('dburi')
+@click.option('--namespace', default='tsh')
+def migrate_dot_six_to_dot_seven(dburi, namespace='tsh'):
+    engine = create_engine(find_dburi(dburi))
+    with engine.begin() as cn:
+        cn.execute(
+            f'create table if not exists "{namespace}".materialized ('
+            '  alias text not null primary key,'
+            '  version text not null,'
+            '  stale boolean not null default false,'
+            '  tz text,'
+            '  idx bytea not null,'
+            '  vals bytea not null,'
+            '  computed timestamptz not null default now()'
+            ')'
+        )
+        cn.execute(
+            f'create table if not exists "{namespace}".dependency ('
+            '  alias text not null,'
+            '  serie text not null,'
+            '  primary key (alias, serie)'
+            ')'
+        )
+        cn.execute(
+            f'create index if not exists "ix_{namespace}_dependency_serie" '
+            f'on "{namespace}".dependency (serie)'
+        )
+        cn.execute(
+            f'create index if not exists "ix_{namespace}_arithmetic_alias" '
+            f'on "{namespace}".arithmetic (alias)'
+        )
+        cn.execute(
+            f'create table if not exists "{namespace}".alias_stats ('
+            '  alias text not null primary key,'
+            '  calls bigint not null,'
+            '  seconds double precision not null,'
+            '  latencies bigint[] not null,'
+            '  points bigint not null,'
+            '  updated timestamptz not null default now()'
+            ')'
+        )
+        cn.execute(
+            f'create table if not exists "{namespace}".alias_generation ('
+            '  generation bigint not null'
+            ')'
+        )
+        cn.execute(
+            f'insert into "{namespace}".alias_generation (generation) '
+            f'select 0 where not exists ('
+            f'  select 1 from "{namespace}".alias_generation'
+            ')'
+        )
+        tsio.timeseries(namespace=namespace).rebuild_dependencies(cn)
+
+
 @click.command(name='shell')
 @click.argument('db-uri')
 @click.option('--namespace', default='tsh')
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+from tshistory_alias.graph import AliasError
+
+
+def fill(ts, fillopt):
+    if fillopt.startswith('fill='):
+        filler = float(fillopt.split('=')[1])
+        return ts.fillna(filler)
+    for method in fillopt.split(','):
+        ts = ts.fillna(method=method.strip())
+    return ts
+
+
+def lastpoints(indexes):
+    """Concatenate a list of indexes and tell, for each distinct date,
+    the position of its last occurrence
+
+    Returns the concatenated index and the positions, in date order.
+    """
+    index = indexes[0].append(indexes[1:])
+    keys = np.asarray(index.values)
+    order = np.argsort(keys, kind='mergesort')
+    keys = keys[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = keys[1:] != keys[:-1]
+    return index, order[last]
+
+
+def priority(alias, members, series, origins=False):
+    """Stack the member series of a priority alias
+
+    The members come lowest priority first; after `coefficient` and
+    `prune`, each one overrides the previous ones where they overlap.
+    This is done in one pass: a stable sort of all the points by value
+    date, keeping the last point of each date.
+
+    With `origins`, the index of the member providing each point is
+    also returned, as a series of small integer codes.
+    """
+    indexes = []
+    values = []
+    codes = []
+    for code, (row, ts) in enumerate(zip(members, series)):
+        if ts is None:
+            continue
+        if ts.dtype != 'O' and row.coefficient != 1:
+            ts = ts * row.coefficient
+        if row.prune:
+            ts = ts[:-row.prune]
+        indexes.append(ts.index)
+        values.append(ts.values)
+        codes.append(np.full(len(ts), code))
+
+    if not indexes:
+        empty = pd.Series(name=alias, dtype='float64')
+        return empty, (empty.astype('int64') if origins else None)
+
+    index, take = lastpoints(indexes)
+    ts_values = pd.Series(
+        np.concatenate(values)[take], index=index[take], name=alias
+    )
+    if not origins:
+        return ts_values, None
+
+    codetype = np.min_scalar_type(len(members))
+    ts_origins = pd.Series(
+        np.concatenate(codes)[take].astype(codetype),
+        index=ts_values.index,
+        name=alias
+    )
+    return ts_values, ts_origins
+
+
+def arithmetic(alias, members, series):
+    """Weighted sum of the member series of an arithmetic alias
+
+    The sum only exists where all members (after `fillopt`) have a
+    value. The members without `fillopt` are folded as they come into
+    a running sum over the intersection of their indexes; the filled
+    ones are kept aside, then filled over that index (or over the
+    union of their indexes when all the members are filled) and
+    added. `series` may be a generator: only the running sum, the
+    current member and the filled members are held at once.
+    """
+    total = None
+    filled = []
+    for row, ts in zip(members, series):
+        if ts is None:
+            parent = getattr(row, 'parent', None) or alias
+            raise AliasError(
+                f'{row.serie} is needed to calculate {parent} and does not exist'
+            )
+        if row.coefficient != 1:
+            ts = ts * row.coefficient
+        if row.fillopt:
+            filled.append((row, ts))
+            continue
+        ts = ts[ts.notnull()].astype('float64')
+        if total is None:
+            total = ts
+            continue
+        index = total.index.intersection(ts.index)
+        total = total.reindex(index) + ts.reindex(index)
+
+    if total is None:
+        index = None
+        for _, ts in filled:
+            index = ts.index if index is None else index.union(ts.index)
+        if index is None:
+            return pd.Series(name=alias, dtype='float64')
+        total = pd.Series(np.zeros(len(index)), index=index)
+
+    index = total.index
+    for row, ts in filled:
+        # a fill only depends on the member points around each date
+        ts = fill(ts.reindex(ts.index.union(index)), row.fillopt)
+        total = total + ts.reindex(index).astype('float64')
+
+    total = total[total.notnull()]
+    total.name = alias
+    return total
+
+
+def staircase(name, history, delta):
+    """Staircase of a series, out of its version history (a dict of
+    insertion date -> series)
+
+    Each value date takes its value from the latest version inserted
+    at least `delta` before it.
+    """
+    indexes = []
+    values = []
+    for idate in sorted(history):
+        ts = history[idate]
+        stamp = idate + delta
+        if ts.index.tz is None and stamp.tzinfo is not None:
+            stamp = stamp.tz_convert('UTC').tz_localize(None)
+        ts = ts[ts.index >= stamp]
+        indexes.append(ts.index)
+        values.append(ts.values)
+
+    if not indexes:
+        return pd.Series(name=name, dtype='float64')
+
+    index, take = lastpoints(indexes)
+    return pd.Series(
+        np.concatenate(values)[take], index=index[take], name=name
+    )
@@ -0,0 +1,182 @@
+from collections import namedtuple
+
+
+class AliasError(Exception):
+    pass
+
+
+prioritymember = namedtuple('prioritymember', 'serie prune coefficient')
+arithmember = namedtuple('arithmember', 'serie fillopt coefficient')
+# arithmetic member, possibly inlined from a nested arithmetic `parent`
+flatmember = namedtuple('flatmember', 'serie fillopt coefficient parent')
+
+
+# the recursion only walks the node names, through the alias indexes
+# of the definition tables (no scan of the whole catalogue)
+GRAPHSQL = '''
+with recursive tree(name) as (
+  select unnest(%(names)s::text[])
+  union
+  select members.serie
+  from tree
+  cross join lateral (
+    select serie from "{ns}".priority where alias = tree.name
+    union all
+    select serie from "{ns}".arithmetic where alias = tree.name
+  ) as members
+)
+select 'member'::text as what, id, 'priority'::text as kind, alias, serie,
+       priority, coefficient, prune, null::text as fillopt,
+       null::double precision as min, null::double precision as max
+from "{ns}".priority
+join tree on priority.alias = tree.name
+union all
+select 'member'::text, id, 'arithmetic'::text, alias, serie,
+       null::integer, coefficient, null::integer, fillopt,
+       null, null
+from "{ns}".arithmetic
+join tree on arithmetic.alias = tree.name
+union all
+select 'bounds'::text, null, null, null, outliers.serie,
+       null, null, null, null, outliers.min, outliers.max
+from "{ns}".outliers
+join tree on outliers.serie = tree.name
+union all
+select 'primary'::text, null, null, null, registry.seriename,
+       null, null, null, null, null, null
+from "{ns}".registry
+join tree on registry.seriename = tree.name
+'''
+
+
+# all the definitions (same columns as GRAPHSQL)
+ALLSQL = '''
+select 'member'::text as what, id, 'priority'::text as kind, alias, serie,
+       priority, coefficient, prune, null::text as fillopt,
+       null::double precision as min, null::double precision as max
+from "{ns}".priority
+union all
+select 'member'::text, id, 'arithmetic'::text, alias, serie,
+       null::integer, coefficient, null::integer, fillopt,
+       null, null
+from "{ns}".arithmetic
+union all
+select 'bounds'::text, null, null, null, serie,
+       null, null, null, null, min, max
+from "{ns}".outliers
+'''
+
+
+# transitive closure of the definitions of the `aliases`, walked as
+# GRAPHSQL through the alias indexes (cycles are harmless: `union`
+# stops on already seen pairs)
+CLOSURESQL = '''
+with recursive closure(alias, serie) as (
+  select aliases.alias, members.serie
+  from unnest(%(aliases)s::text[]) as aliases(alias)
+  cross join lateral (
+    select serie from "{ns}".priority where alias = aliases.alias
+    union all
+    select serie from "{ns}".arithmetic where alias = aliases.alias
+  ) as members
+  union
+  select closure.alias, members.serie
+  from closure
+  cross join lateral (
+    select serie from "{ns}".priority where alias = closure.serie
+    union all
+    select serie from "{ns}".arithmetic where alias = closure.serie
+  ) as members
+)
+insert into "{ns}".dependency (alias, serie)
+select alias, serie from closure
+'''
+
+
+class aliasgraph:
+    """In-memory view of the definitions of a set of aliases
+
+    `kinds` maps each alias to its kind, `members` maps each alias to
+    its member rows (in evaluation order) and `bounds` maps the series
+    having outliers bounds to their (min, max) pair. `primaries` holds
+    the nodes known as primary series (filled by `load` only).
+    """
+
+    def __init__(self, names=()):
+        self.names = list(names)
+        self.kinds = {}
+        self.members = {}
+        self.bounds = {}
+        self.primaries = set()
+
+    @classmethod
+    def load(cls, cn, namespace, names):
+        """Load the transitive definition of `names` in one query"""
+        graph = cls(names)
+        rows = cn.execute(
+            GRAPHSQL.format(ns=namespace),
+            names=graph.names
+        ).fetchall()
+        graph.feed(rows)
+        return graph
+
+    @classmethod
+    async def aload(cls, acn, namespace, names):
+        """Coroutine version of `load`, on an aio.connection or pool"""
+        graph = cls(names)
+        graph.feed(await acn.execute(
+            GRAPHSQL.format(ns=namespace),
+            names=graph.names
+        ))
+        return graph
+
+    @classmethod
+    def loadall(cls, cn, namespace):
+        """Load all the alias definitions in one query"""
+        graph = cls()
+        graph.feed(cn.execute(ALLSQL.format(ns=namespace)).fetchall())
+        graph.names = sorted(graph.members)
+        return graph
+
+    def feed(self, rows):
+        members = {}
+        for row in rows:
+            if row.what == 'bounds':
+                self.bounds[row.serie] = (row.min, row.max)
+                continue
+            if row.what == 'primary':
+                self.primaries.add(row.serie)
+                continue
+            self.kinds[row.alias] = row.kind
+            members.setdefault(row.alias, []).append(row)
+
+        for alias, rows in members.items():
+            if self.kinds[alias] == 'priority':
+                rows.sort(key=lambda row: row.priority, reverse=True)
+                self.members[alias] = [
+                    prioritymember(row.serie, row.prune, row.coefficient)
+                    for row in rows
+                ]
+            else:
+                rows.sort(key=lambda row: row.id)
+                self.members[alias] = [
+                    arithmember(row.serie, row.fillopt, row.coefficient)
+                    for row in rows
+                ]
+
+    def kind(self, name):
+        return self.kinds.get(name, 'primary')
+
+    def children(self, name):
+        members = self.members.get(name, ())
+        if self.kind(name) == 'priority':
+            # highest priority first
+            members = reversed(members)
+        return [member.serie for member in members]
+
+    def nodes(self):
+        seen = set(self.names)
+        for alias, members in self.members.items():
+            seen.add(alias)
+            seen.update(member.serie for member in members)
+        return seen
@@ -1,28 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
 import pandas as pd
+from sqlalchemy import event
+
+from tshistory_alias.graph import AliasError, aliasgraph
+from tshistory_alias.plan import evaluation
 
 
-def buildtree(engine, tsh, alias, ancestors, depth=0):
-    kind = tsh.type(engine, alias)
+def buildtree(engine, tsh, alias, ancestors, depth=0, graph=None,
+              known=None, memo=None):
+    if memo is not None and alias in memo:
+        return memo[alias]
+    if graph is None:
+        graph = tsh.graph(engine, [alias])
+    kind = graph.kind(alias)
     if kind == 'primary':
-        if not tsh.exists(engine, alias):
+        exists = alias in known if known is not None else tsh.exists(engine, alias)
+        if not exists:
             return f'unknown `{alias}`'
         return alias
 
     ancestors.append(alias)
 
-    series = [name for name, in engine.execute(
-        f'select serie from "{tsh.namespace}".{kind} '
-        'where alias = %(alias)s', alias=alias).fetchall()
-    ]
+    series = graph.children(alias)
     leaves = []
     for name in series:
         if name in ancestors:
             print(name, 'in ancestors', ancestors)
             raise Exception('Loop')
-        leaves.append(buildtree(engine, tsh, name, ancestors, depth+1))
+        leaves.append(
+            buildtree(engine, tsh, name, ancestors, depth+1, graph, known, memo)
+        )
 
     ancestors.pop()
-    return {(alias, kind): leaves}
+    tree = {(alias, kind): leaves}
+    if memo is not None:
+        memo[alias] = tree
+    return tree
+
+
+def buildtrees(engine, tsh, aliases=None):
+    """Build the trees of `aliases` (all by default) out of their
+    definition graph, loaded at once
+
+    The shared subtrees are built once, and the existence of the
+    primary leaves is checked in one query.
+    """
+    if aliases is not None:
+        # the graph of the aliases knows its primary leaves
+        graph = aliasgraph.load(engine, tsh.namespace, aliases)
+        known = graph.primaries
+    else:
+        graph = aliasgraph.loadall(engine, tsh.namespace)
+        aliases = graph.names
+        leaves = [
+            name for name in graph.nodes()
+            if name not in graph.members
+        ]
+        known = {
+            name for name, in engine.execute(
+                f'select seriename from "{tsh.namespace}".registry '
+                'where seriename = any(%(names)s::text[])',
+                names=leaves
+            ).fetchall()
+        }
+    memo = {}
+    return [
+        buildtree(engine, tsh, alias, [], graph=graph, known=known, memo=memo)
+        for alias in aliases
+    ]
 
 
 def sortkey(item):
@@ -41,6 +89,105 @@ def showtree(tree, depth=0, printer=print):
             showtree(child, depth + 1, printer)
 
 
+def verify(engine, tsh, names, jobs=1):
+    """Evaluate `names` over `jobs` threads and report, for each one,
+    its latency, point count and query count
+
+    The names are evaluated by dependency level, children first. The
+    results of the names are shared with the later levels reading
+    them, then dropped; the other nodes are only kept for the time of
+    their own evaluation.
+    """
+    graph = tsh.graph(engine, names)
+    depth = {}
+
+    def level(name):
+        if name not in depth:
+            depth[name] = 0  # cycle guard (the evaluation reports it)
+            depth[name] = 1 + max(
+                (level(child) for child in graph.children(name)),
+                default=-1
+            )
+        return depth[name]
+
+    levels = {}
+    for name in names:
+        levels.setdefault(level(name), []).append(name)
+
+    # the checked names below each name, and the last level reading them
+    checked = set(names)
+    below = {}
+    lastuse = {}
+    for name in checked:
+        seen = set()
+        stack = list(graph.children(name))
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.extend(graph.children(node))
+        below[name] = seen & checked
+        for node in below[name]:
+            lastuse[node] = max(lastuse.get(node, -1), depth[name])
+
+    local = threading.local()
+
+    def count(*args):
+        if hasattr(local, 'queries'):
+            local.queries += 1
+
+    # results of the checked names, by evaluation key
+    shared = {}
+    keyof = evaluation(tsh, engine).key
+
+    def check(name):
+        local.queries = 0
+        t0 = time()
+        ev = evaluation(tsh, engine, max_workers=1)
+        ev.memo = {
+            key: shared[key]
+            for key in (keyof(node, None, None) for node in below[name])
+            if key in shared
+        }
+        points = None
+        try:
+            ts = ev.run(name)
+        except AliasError as err:
+            status = str(err)
+        else:
+            if name in lastuse:
+                shared[keyof(name, None, None)] = ts
+            if ts is None:
+                status = 'unknown'
+            else:
+                points = len(ts)
+                status = 'ok'
+                if not ts.index.is_monotonic_increasing:
+                    status = 'non monotonic'
+        return {
+            'name': name,
+            'kind': graph.kind(name),
+            'seconds': time() - t0,
+            'points': points,
+            'queries': local.queries,
+            'status': status
+        }
+
+    report = []
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        with ThreadPoolExecutor(jobs) as pool:
+            for rank in sorted(levels):
+                report.extend(pool.map(check, levels[rank]))
+                for name, last in lastuse.items():
+                    if last == rank:
+                        shared.pop(keyof(name, None, None), None)
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+    return report
+
+
 def alias_table(engine, tsh, id_serie, fromdate=None, todate=None,
                 author=None, additionnal_info=None, url_base_pathname=''):
     '''
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+def encode(ts):
+    """Turn a series into (tz, index bytes, values bytes)"""
+    if not len(ts):
+        return None, b'', b''
+    index = ts.index
+    tz = str(index.tz) if index.tz is not None else None
+    return (
+        tz,
+        index.asi8.tobytes(),
+        ts.values.astype('float64').tobytes()
+    )
+
+
+def decode(name, tz, idx, vals):
+    index = pd.DatetimeIndex(
+        np.frombuffer(idx, dtype='int64').astype('datetime64[ns]')
+    )
+    if tz is not None:
+        index = index.tz_localize('UTC').tz_convert(tz)
+    return pd.Series(
+        np.frombuffer(vals, dtype='float64').copy(),
+        index=index,
+        name=name
+    )
+
+
+def inside(ts, from_value_date=None, to_value_date=None):
+    """Mask of the points of a series within a value-date window"""
+    tz = ts.index.tz
+    mask = np.ones(len(ts), dtype=bool)
+    for bound, keep in ((from_value_date, ts.index.__ge__),
+                        (to_value_date, ts.index.__le__)):
+        if bound is None:
+            continue
+        bound = pd.Timestamp(bound)
+        if tz is not None and bound.tzinfo is None:
+            bound = bound.tz_localize('UTC')
+        elif tz is None and bound.tzinfo is not None:
+            bound = bound.tz_convert('UTC').tz_localize(None)
+        mask &= keep(bound)
+    return mask
+
+
+def window(ts, from_value_date=None, to_value_date=None):
+    """Restrict a series to a value-date window"""
+    return ts[inside(ts, from_value_date, to_value_date)]
+
+
+def patch(stored, fresh, from_value_date=None, to_value_date=None):
+    """Replace the points of `stored` within a value-date window by
+    those of `fresh`
+    """
+    if not len(stored):
+        return fresh
+    kept = stored[~inside(stored, from_value_date, to_value_date)]
+    return pd.concat([kept, fresh]).sort_index()
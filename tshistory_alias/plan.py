@@ -0,0 +1,748 @@
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from tshistory_alias import combine
+from tshistory_alias.graph import AliasError, flatmember
+
+
+def align(stamp, like):
+    """Make a series timestamp comparable with a window bound"""
+    if like is None:
+        return stamp
+    stamp = pd.Timestamp(stamp)
+    if getattr(like, 'tzinfo', None) is None and stamp.tzinfo is not None:
+        return stamp.tz_convert('UTC').tz_localize(None)
+    if getattr(like, 'tzinfo', None) is not None and stamp.tzinfo is None:
+        return stamp.tz_localize('UTC')
+    return stamp
+
+
+def utc(stamp):
+    """Timestamp as a tz-aware UTC one (naive ones being UTC)"""
+    stamp = pd.Timestamp(stamp)
+    if stamp.tzinfo is None:
+        return stamp.tz_localize('UTC')
+    return stamp.tz_convert('UTC')
+
+
+def subtract(gaps, start, end):
+    """Remove the closed [start, end] interval from a list of closed
+    intervals (None meaning unbounded)
+    """
+    remaining = []
+    for lo, hi in gaps:
+        start = align(start, lo if lo is not None else hi)
+        end = align(end, lo if lo is not None else hi)
+        if (hi is not None and hi < start) or (lo is not None and end < lo):
+            remaining.append((lo, hi))
+            continue
+        if lo is None or lo < start:
+            remaining.append((lo, start))
+        if hi is None or end < hi:
+            remaining.append((end, hi))
+    return remaining
+
+
+class plan:
+    """Deduplicated evaluation plan of an alias
+
+    `kinds` maps every distinct node of the alias tree to its kind,
+    `members` maps the alias nodes to their member rows and `order`
+    lists the nodes children first, each node exactly once.
+
+    `terms` maps the arithmetic nodes having nested arithmetic members
+    to their flattened definition (see `flatten`), `windows` maps
+    every node to its `windowed` flag and `bounded` tells if outliers
+    bounds apply to a node or to its subtree.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.kinds = {}
+        self.members = {}
+        self.terms = {}
+        self.windows = {}
+        self.bounded = {}
+        self.order = []
+
+    @classmethod
+    def compile(cls, tsh, cn, name, graph=None):
+        """Build the plan of `name` from the (cached) alias definitions,
+        or without any query from its loaded aliasgraph
+
+        Raises an AliasError when the definitions contain a cycle.
+        """
+        compiled = cls(name)
+        if graph is None:
+            kindof = partial(tsh.type, cn)
+            membersof = partial(tsh._members, cn)
+        else:
+            kindof = graph.kind
+            membersof = lambda alias, kind: graph.members[alias]
+        # depth-first walk, with the path of the current branch
+        # kept for cycle detection
+        path = []
+        onpath = set()
+        stack = [(name, None)]
+        while stack:
+            node, children = stack.pop()
+            if children is None:
+                if node in compiled.kinds:
+                    continue
+                if node in onpath:
+                    cycle = path[path.index(node):] + [node]
+                    raise AliasError(
+                        f'cycle detected in {name}: {" -> ".join(cycle)}'
+                    )
+                kind = kindof(node)
+                if kind not in tsh.alias_types:
+                    compiled.kinds[node] = kind
+                    compiled.order.append(node)
+                    continue
+                members = membersof(node, kind)
+                compiled.members[node] = members
+                path.append(node)
+                onpath.add(node)
+                children = [row.serie for row in members]
+                # mark the node as pending until its children are done
+                stack.append((node, ()))
+                for child in reversed(children):
+                    stack.append((child, None))
+                continue
+            # all children visited
+            path.pop()
+            onpath.discard(node)
+            compiled.kinds[node] = kindof(node)
+            compiled.order.append(node)
+
+        unbounded = [
+            node for node in compiled.order
+            if node not in tsh.aliascache.bounds
+        ]
+        if unbounded and graph is not None:
+            for node in unbounded:
+                tsh.aliascache.bounds[node] = graph.bounds.get(node)
+        elif unbounded:
+            tsh.preload_bounds(cn, unbounded)
+        # children first: each node is looked at once
+        for node in compiled.order:
+            compiled.windows[node] = any(
+                getattr(row, 'prune', None) or
+                getattr(row, 'fillopt', None) or
+                compiled.windows[row.serie]
+                for row in compiled.members.get(node, ())
+            )
+            compiled.bounded[node] = bool(tsh.bounds(cn, node)) or any(
+                compiled.bounded[row.serie]
+                for row in compiled.members.get(node, ())
+            )
+        compiled.flatten(tsh, cn)
+        return compiled
+
+    def flatten(self, tsh, cn):
+        """Inline the nested arithmetic aliases into their parents
+
+        A nested arithmetic without fillopt (neither on itself nor on
+        its members) and without outliers bounds is a mere linear
+        combination: its parent can sum its members directly, with
+        the composed coefficients.
+        """
+        flattenable = {
+            name for name in self.order
+            if self.kinds[name] == 'arithmetic' and
+            not tsh.bounds(cn, name) and
+            not any(row.fillopt for row in self.members[name])
+        }
+        for alias in self.order:
+            if self.kinds[alias] != 'arithmetic':
+                continue
+            terms = []
+            inlined = False
+            for row in self.members[alias]:
+                if row.fillopt or row.serie not in flattenable:
+                    terms.append(
+                        flatmember(row.serie, row.fillopt, row.coefficient, alias)
+                    )
+                    continue
+                inlined = True
+                for term in self.inputs(row.serie):
+                    terms.append(
+                        flatmember(
+                            term.serie, None,
+                            row.coefficient * term.coefficient,
+                            term.parent
+                        )
+                    )
+            if inlined:
+                self.terms[alias] = self.merge(terms)
+
+    @staticmethod
+    def merge(terms):
+        """Sum the coefficients of the unfilled terms of a same series
+
+        Such terms only count over the intersection of the members:
+        the series is read and added once, however many paths lead to
+        it.
+        """
+        merged = []
+        positions = {}
+        for term in terms:
+            if term.fillopt:
+                merged.append(term)
+                continue
+            pos = positions.get(term.serie)
+            if pos is None:
+                positions[term.serie] = len(merged)
+                merged.append(term)
+                continue
+            merged[pos] = merged[pos]._replace(
+                coefficient=merged[pos].coefficient + term.coefficient
+            )
+        return merged
+
+    def version(self, tsh, cn):
+        """Digest of the whole definition (members and bounds) of the
+        plan
+        """
+        digest = hashlib.sha1()
+        for name in sorted(self.order):
+            digest.update(repr((
+                name,
+                self.kinds[name],
+                [tuple(row) for row in self.members.get(name, ())],
+                tsh.bounds(cn, name)
+            )).encode('utf-8'))
+        return digest.hexdigest()
+
+    def span(self, tsh, cn, leaf, start, end):
+        """Value-date span of the plan possibly changed by an update of
+        `leaf` over [start, end]
+
+        Returns a (read_from, start, end) triple: the plan must be read
+        from `read_from` to `end` (None: open) and its points over
+        [start, end] replaced. Returns None when no such span can be
+        bounded and the plan must be recomputed from scratch.
+        """
+        if any(getattr(row, 'prune', None)
+               for rows in self.members.values()
+               for row in rows):
+            # the pruned tail is the end of the read window
+            end = None
+
+        touched = {leaf}
+        filled = []
+        for name in self.order:
+            for row in self.members.get(name, ()):
+                fillopt = getattr(row, 'fillopt', None) or ''
+                methods = {
+                    method.strip() for method in fillopt.split(',')
+                } if fillopt and not fillopt.startswith('fill=') else set()
+                forward = bool(methods & {'ffill', 'pad'})
+                backward = bool(methods & {'bfill', 'backfill'})
+                if methods:
+                    if row.serie in self.members:
+                        # the filled member would need its own lookback
+                        return None
+                    if forward:
+                        filled.append(row.serie)
+                    if backward and row.serie not in touched:
+                        # fills backwards from past the end of the span
+                        end = None
+                if row.serie not in touched:
+                    continue
+                touched.add(name)
+                if getattr(row, 'prune', None):
+                    # points hidden by the former tail may show up
+                    start = tsh._previous(cn, row.serie, start, row.prune)
+                if forward:
+                    end = None
+                if backward:
+                    start = tsh._previous(cn, row.serie, start, 1)
+                if start is None:
+                    return None
+
+        # the forward filled members need a point before the span
+        readfrom = start
+        for serie in filled:
+            previous = tsh._previous(cn, serie, start, 1)
+            if previous is None:
+                readfrom = None
+                break
+            readfrom = min(readfrom, align(previous, readfrom))
+        return readfrom, start, end
+
+    def inputs(self, name):
+        """Rows the value of `name` is computed from"""
+        if name in self.terms:
+            return self.terms[name]
+        return [
+            flatmember(row.serie, row.fillopt, row.coefficient, name)
+            if self.kinds[name] == 'arithmetic' else row
+            for row in self.members[name]
+        ]
+
+    def leaves(self):
+        return [
+            name for name in self.order
+            if name not in self.members
+        ]
+
+    def windowed(self, name):
+        """Tell if the subtree of `name` depends on the exact value-date
+        window it is read over (beyond a mere slicing)
+
+        This is the case as soon as a priority prunes (the pruned tail
+        is the end of the window) or an arithmetic fills (the filling
+        looks outside the window). Computed by `compile`.
+        """
+        return self.windows[name]
+
+    def levels(self):
+        """Group the nodes in lists of mutually independent nodes
+
+        The first list holds the leaves, and every node comes after
+        all of its children.
+        """
+        depth = {}
+        levels = []
+        for name in self.order:
+            depth[name] = 1 + max(
+                (depth[row.serie] for row in self.members.get(name, ())),
+                default=-1
+            )
+            if depth[name] == len(levels):
+                levels.append([])
+            levels[depth[name]].append(name)
+        return levels
+
+
+class evaluation:
+    """One alias read, with per-evaluation memoization
+
+    Each distinct (name, revision_date, delta, value-date window) is
+    computed once, however many times it appears in the tree.
+
+    With more than one worker and an engine (each worker needs its own
+    connection), the leaves and the independent alias nodes are
+    evaluated on a thread pool.
+
+    With `pushdown`, the members of a priority are read highest
+    priority first, each one only over the value-date intervals not
+    yet covered by the previous ones. This assumes the members are
+    dense over their span: a hole inside a higher priority member
+    will not be filled by the lower priority ones. The members with
+    outliers bounds in their subtree are read over the whole window
+    and cover nothing.
+
+    The members of an arithmetic without `fillopt` are read over the
+    intersection of their value-date extents only (see
+    `member_window`).
+
+    Unless evaluated on the thread pool, each memoized value is
+    dropped as soon as all the nodes reading it are done.
+
+    With `stream`, the evaluation is sequential and the members of an
+    arithmetic are read and summed one at a time. A wide arithmetic
+    then holds about one member plus the running sum (and its filled
+    members).
+    """
+
+    def __init__(self, tsh, cn, revision_date=None, delta=None,
+                 max_workers=None, pushdown=None, stream=None):
+        self.tsh = tsh
+        self.cn = cn
+        self.revision_date = revision_date
+        self.delta = delta
+        if max_workers is None:
+            max_workers = tsh.max_workers
+        self.max_workers = max_workers
+        if pushdown is None:
+            pushdown = tsh.pushdown
+        self.pushdown = pushdown
+        if stream is None:
+            stream = tsh.stream
+        self.stream = stream
+        self.memo = {}
+        # remaining reads of the memoized values
+        self.uses = {}
+        self.extents = {}
+
+    @property
+    def parallel(self):
+        return (
+            self.tsh.tracer is None and
+            self.max_workers is not None and
+            self.max_workers > 1 and
+            isinstance(self.cn, Engine)
+        )
+
+    def key(self, name, from_value_date, to_value_date):
+        return (
+            name, self.revision_date, self.delta,
+            from_value_date, to_value_date
+        )
+
+    @property
+    def pooled(self):
+        """Tell if the nodes are evaluated level by level on a thread
+        pool (see `run`)
+        """
+        return self.parallel and not self.pushdown and not self.stream
+
+    def prepare(self, name, from_value_date=None, to_value_date=None):
+        compiled = plan.compile(self.tsh, self.cn, name)
+        if not self.pooled:
+            self.uses = self.usecounts(
+                compiled, name, (from_value_date, to_value_date)
+            )
+        return compiled
+
+    def run(self, name, from_value_date=None, to_value_date=None):
+        compiled = self.prepare(name, from_value_date, to_value_date)
+        if self.pooled:
+            requests = self.requests(
+                compiled, name, (from_value_date, to_value_date)
+            )
+            with ThreadPoolExecutor(self.max_workers) as pool:
+                for level in compiled.levels():
+                    list(pool.map(
+                        lambda request: self.value(compiled, *request),
+                        [(node, lo, hi)
+                         for node in level
+                         for lo, hi in requests.get(node, ())]
+                    ))
+        return self.value(compiled, name, from_value_date, to_value_date)
+
+    async def arun(self, name, from_value_date=None, to_value_date=None,
+                   compiled=None):
+        """Asynchronous run, for an engine, always without pushdown nor
+        streaming (which read lazily)
+
+        tshistory being synchronous, the leaf queries go to the
+        default executor of the running loop (with the extents ones
+        when narrowing the arithmetic members), split over at most
+        `max_workers` concurrent calls; the leaves are then combined
+        on the loop. Without a `compiled` plan, the definitions are
+        read in the executor too.
+        """
+        # both would read from the loop
+        self.pushdown = self.stream = False
+        loop = asyncio.get_running_loop()
+        if compiled is None:
+            compiled = await loop.run_in_executor(
+                None, plan.compile, self.tsh, self.cn, name
+            )
+        requests = await loop.run_in_executor(
+            None, self.requests,
+            compiled, name, (from_value_date, to_value_date)
+        )
+        leaves = [
+            (leaf, lo, hi)
+            for leaf in compiled.leaves()
+            for lo, hi in requests[leaf]
+        ]
+        workers = max(1, min(self.max_workers or 1, len(leaves)))
+        await asyncio.gather(*[
+            loop.run_in_executor(
+                None, self.values, compiled, leaves[idx::workers]
+            )
+            for idx in range(workers)
+        ])
+        return self.value(compiled, name, from_value_date, to_value_date)
+
+    def values(self, compiled, requests):
+        """Evaluate a list of (name, from, to) requests in a row"""
+        for request in requests:
+            self.value(compiled, *request)
+
+    def requests(self, compiled, name, window):
+        """Collect the distinct windows each node will be read over"""
+        requests = {}
+        stack = [(name, window)]
+        while stack:
+            node, window = stack.pop()
+            windows = requests.setdefault(node, [])
+            if window in windows:
+                continue
+            windows.append(window)
+            if node not in compiled.members:
+                continue
+            for row in compiled.inputs(node):
+                stack.append((
+                    row.serie,
+                    self.member_window(compiled, node, row, window)
+                ))
+        return requests
+
+    def usecounts(self, compiled, name, window):
+        """Count the reads of each (node, window) by the alias nodes"""
+        uses = {}
+        for node, windows in self.requests(compiled, name, window).items():
+            if node not in compiled.members:
+                continue
+            for window in windows:
+                for row in compiled.inputs(node):
+                    key = self.key(
+                        row.serie,
+                        *self.member_window(compiled, node, row, window)
+                    )
+                    uses[key] = uses.get(key, 0) + 1
+        return uses
+
+    def release(self, key):
+        """Account for one read of a memoized value, dropped after the
+        last one
+        """
+        if key not in self.uses:
+            return
+        self.uses[key] -= 1
+        if not self.uses[key]:
+            del self.uses[key]
+            self.memo.pop(key, None)
+
+    # arithmetic range narrowing
+
+    def member_window(self, compiled, alias, row, window):
+        """Value-date window to read a member of `alias` over
+
+        The members of an arithmetic without `fillopt` only count over
+        the intersection of the extents of those members: when their
+        own subtree does not depend on its exact window, their window
+        is narrowed to it.
+        """
+        if (compiled.kinds[alias] != 'arithmetic' or
+            row.fillopt or
+            compiled.windowed(row.serie)):
+            return window
+
+        extent = self.intersection(compiled, alias)
+        if extent is None:
+            return window
+
+        lo, hi = window
+        first, last = extent
+        first = align(first, lo)
+        last = align(last, hi)
+        if lo is None or lo < first:
+            lo = first
+        if hi is None or last < hi:
+            hi = last
+        if hi < lo:
+            # empty anyway
+            return window
+        return lo, hi
+
+    def intersection(self, compiled, alias):
+        key = ('intersection', alias)
+        if key not in self.extents:
+            members = [
+                row for row in compiled.members[alias]
+                if not row.fillopt
+            ]
+            extent = None
+            if (len(members) > 1 and
+                self.revision_date is None and
+                self.delta is None):
+                extents = [
+                    self.extent(compiled, row.serie)
+                    for row in members
+                ]
+                if None not in extents:
+                    extent = (
+                        max(first for first, _ in extents),
+                        min(last for _, last in extents)
+                    )
+            self.extents[key] = extent
+        return self.extents[key]
+
+    def extent(self, compiled, name):
+        """First and last value dates `name` can have, or None if
+        unknown
+        """
+        if name in self.extents:
+            return self.extents[name]
+
+        members = compiled.members.get(name)
+        if members is None:
+            # all the leaves at once
+            self.extents.update(
+                self.tsh._extents(self.cn, [
+                    leaf for leaf in compiled.leaves()
+                    if leaf not in self.extents
+                ])
+            )
+            return self.extents[name]
+
+        kind = compiled.kinds[name]
+        bound = [
+            row for row in members
+            if not getattr(row, 'fillopt', None)
+        ]
+        extents = [
+            self.extent(compiled, row.serie)
+            for row in (bound if kind == 'arithmetic' and bound else members)
+        ]
+        if None in extents:
+            extent = None
+        elif kind == 'arithmetic' and bound:
+            extent = (
+                max(first for first, _ in extents),
+                min(last for _, last in extents)
+            )
+        else:
+            extent = (
+                min(first for first, _ in extents),
+                max(last for _, last in extents)
+            )
+        self.extents[name] = extent
+        return extent
+
+    def timed(self, what):
+        """Account the time of a block to the traced node, if any"""
+        if self.tsh.tracer is None:
+            return nullcontext()
+        return self.tsh.tracer.timed(what)
+
+    def value(self, compiled, name, from_value_date, to_value_date):
+        tracer = self.tsh.tracer
+        if tracer is None:
+            return self._value(compiled, name, from_value_date, to_value_date)
+        with tracer.node(name, compiled.kinds[name]) as node:
+            node.cached = (
+                self.key(name, from_value_date, to_value_date) in self.memo
+            )
+            ts = self._value(compiled, name, from_value_date, to_value_date)
+            node.points = None if ts is None else len(ts)
+        return ts
+
+    def _value(self, compiled, name, from_value_date, to_value_date):
+        key = self.key(name, from_value_date, to_value_date)
+        if key in self.memo:
+            return self.memo[key]
+
+        kind = compiled.kinds[name]
+        if kind == 'priority':
+            ts, _ = self.priority(
+                compiled, name, from_value_date, to_value_date
+            )
+        elif kind == 'arithmetic':
+            ts = self.arithmetic(
+                compiled, name, from_value_date, to_value_date
+            )
+        else:
+            ts = self.tsh._get_primary(
+                self.cn, name,
+                revision_date=self.revision_date,
+                delta=self.delta,
+                from_value_date=from_value_date,
+                to_value_date=to_value_date
+            )
+
+        if ts is not None:
+            with self.timed('bounds'):
+                ts = self.tsh.apply_bounds(self.cn, ts, name)
+        self.memo[key] = ts
+        return ts
+
+    def _series(self, compiled, alias, from_value_date, to_value_date):
+        members = compiled.inputs(alias)
+        windows = [
+            self.member_window(
+                compiled, alias, row, (from_value_date, to_value_date)
+            )
+            for row in members
+        ]
+        series = [
+            self.value(compiled, row.serie, *window)
+            for row, window in zip(members, windows)
+        ]
+        # held by `series` until combined: the memo may forget them
+        for row, window in zip(members, windows):
+            self.release(self.key(row.serie, *window))
+        return members, series
+
+    def priority(self, compiled, alias,
+                 from_value_date=None, to_value_date=None,
+                 origins=False):
+        if self.pushdown:
+            members, series = self._pushed_series(
+                compiled, alias, from_value_date, to_value_date
+            )
+        else:
+            members, series = self._series(
+                compiled, alias, from_value_date, to_value_date
+            )
+        with self.timed('combine'):
+            return combine.priority(alias, members, series, origins)
+
+    def _pushed_series(self, compiled, alias, from_value_date, to_value_date):
+        members = compiled.members[alias]
+        series = [None] * len(members)
+        gaps = [(from_value_date, to_value_date)]
+        # highest priority first
+        for pos in reversed(range(len(members))):
+            if not gaps:
+                break
+            row = members[pos]
+            bounded = compiled.bounded[row.serie]
+            if row.prune or bounded or compiled.windowed(row.serie):
+                # e.g. a pruned tail depends on the exact window
+                ts = self.value(
+                    compiled, row.serie, from_value_date, to_value_date
+                )
+            else:
+                ts = self._gaps_value(compiled, row.serie, gaps)
+            series[pos] = ts
+            if ts is None or bounded:
+                # the outliers leave holes within [first, last]
+                continue
+            if row.prune:
+                ts = ts[:-row.prune]
+            if len(ts):
+                gaps = subtract(gaps, ts.index[0], ts.index[-1])
+        return members, series
+
+    def _gaps_value(self, compiled, name, gaps):
+        pieces = [
+            self.value(compiled, name, lo, hi)
+            for lo, hi in gaps
+        ]
+        pieces = [piece for piece in pieces if piece is not None]
+        if not pieces:
+            return None
+        if len(pieces) == 1:
+            return pieces[0]
+        ts = pd.concat(pieces).sort_index()
+        return ts[~ts.index.duplicated()]
+
+    def arithmetic(self, compiled, alias,
+                   from_value_date=None, to_value_date=None):
+        if self.stream:
+            members = compiled.inputs(alias)
+            return combine.arithmetic(
+                alias, members,
+                self._stream(
+                    compiled, alias, members, (from_value_date, to_value_date)
+                )
+            )
+        members, series = self._series(
+            compiled, alias, from_value_date, to_value_date
+        )
+        with self.timed('combine'):
+            return combine.arithmetic(alias, members, series)
+
+    def _stream(self, compiled, alias, members, window):
+        """Read the members one at a time, forgetting each one once it
+        is no longer needed
+        """
+        for row in members:
+            memberwindow = self.member_window(compiled, alias, row, window)
+            ts = self.value(compiled, row.serie, *memberwindow)
+            self.release(self.key(row.serie, *memberwindow))
+            yield ts
@@ -13,6 +13,7 @@ create table "{ns}".arithmetic (
   fillopt text
 );
 
+create index "ix_{ns}_arithmetic_alias" on "{ns}".arithmetic (alias);
 create index "ix_{ns}_arithmetic_serie" on "{ns}".arithmetic (serie);
 
 
@@ -27,3 +28,45 @@ create table "{ns}".priority (
 
 create index "ix_{ns}_priority_alias" on "{ns}".priority (alias);
 create index "ix_{ns}_priority_serie" on "{ns}".priority (serie);
+
+
+create table "{ns}".materialized (
+  alias text not null primary key,
+  version text not null,
+  stale boolean not null default false,
+  tz text,
+  idx bytea not null,
+  vals bytea not null,
+  computed timestamptz not null default now()
+);
+
+
+-- transitive closure of the alias definitions
+create table "{ns}".dependency (
+  alias text not null,
+  serie text not null,
+  primary key (alias, serie)
+);
+
+create index "ix_{ns}_dependency_serie" on "{ns}".dependency (serie);
+
+
+-- alias read statistics (see stats.collector)
+create table "{ns}".alias_stats (
+  alias text not null primary key,
+  calls bigint not null,
+  seconds double precision not null,
+  -- latency histogram (see stats.collector)
+  latencies bigint[] not null,
+  points bigint not null,
+  updated timestamptz not null default now()
+);
+
+
+-- definitions generation, bumped by every definition change
+-- (see timeseries._fresh)
+create table "{ns}".alias_generation (
+  generation bigint not null
+);
+
+insert into "{ns}".alias_generation (generation) values (0);
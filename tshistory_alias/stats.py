@@ -0,0 +1,147 @@
+import atexit
+import threading
+from math import ceil, log
+from time import time
+
+
+# latency histogram: bucket `i` counts the reads of at most
+# BASE * RATIO ** i seconds (and more than the previous bound), the
+# last one all the longer reads
+BASE = 1e-4
+RATIO = 2 ** .25
+BUCKETS = 96
+
+
+UPSERTSQL = '''
+insert into "{ns}".alias_stats (alias, calls, seconds, latencies, points, updated)
+values (%(alias)s, %(calls)s, %(seconds)s, %(latencies)s, %(points)s, now())
+on conflict (alias) do update
+set calls = alias_stats.calls + excluded.calls,
+    seconds = alias_stats.seconds + excluded.seconds,
+    latencies = array(
+      select stored + added
+      from unnest(alias_stats.latencies, excluded.latencies)
+           with ordinality as merged(stored, added, bucket)
+      order by bucket
+    ),
+    points = alias_stats.points + excluded.points,
+    updated = now()
+'''
+
+
+# upper bound of the bucket holding the %(percentile)s latency of the
+# `latencies` histogram of an alias_stats row (null without reads)
+PERCENTILESQL = '''
+select min(%(base)s * power(%(ratio)s, bucket - 1)) as p95
+from (
+  select bucket,
+         sum(reads) over (order by bucket) as cumulated,
+         sum(reads) over () as total
+  from unnest(latencies) with ordinality as histogram(reads, bucket)
+) as histogram
+where cumulated >= %(percentile)s * total
+'''
+
+
+def bucket(seconds):
+    """Latency histogram bucket of a read of `seconds`"""
+    if seconds <= BASE:
+        return 0
+    return min(BUCKETS - 1, ceil(log(seconds / BASE, RATIO)))
+
+
+class collector:
+    """In-memory per-alias read statistics (call count, cumulated
+    latency and result size, latency histogram), to be flushed every
+    `interval` seconds into the alias_stats table
+
+    Recording a read is a few dict operations under a lock. The
+    histograms of the successive flushes add up in the table, from
+    which the p95 latency is derived (see PERCENTILESQL).
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.since = time()
+        # where the timer and exit flushes go (see `start`)
+        self.engine = None
+        self.flusher = None
+        self.stopped = threading.Event()
+
+    def record(self, name, seconds, points):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                entry = self.entries[name] = [0, 0., 0, [0] * BUCKETS]
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += points
+            entry[3][bucket(seconds)] += 1
+
+    def due(self):
+        return time() - self.since >= self.interval
+
+    def start(self, flusher):
+        """Call `flusher` every `interval` seconds from a daemon
+        thread, and once more at exit (see `stop`)
+        """
+        self.flusher = flusher
+
+        def run():
+            while not self.stopped.wait(self.interval):
+                flusher()
+
+        threading.Thread(target=run, name='alias-stats', daemon=True).start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the timer and flush the last entries"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        atexit.unregister(self.stop)
+        if self.flusher is not None:
+            self.flusher()
+
+    def take(self):
+        """Entries of the period, which is then reset"""
+        with self.lock:
+            entries, self.entries = self.entries, {}
+            self.since = time()
+        return entries
+
+    def restore(self, entries):
+        """Merge back the entries of a failed flush"""
+        with self.lock:
+            for name, (calls, seconds, points, latencies) in entries.items():
+                entry = self.entries.get(name)
+                if entry is None:
+                    self.entries[name] = [calls, seconds, points, latencies]
+                    continue
+                entry[0] += calls
+                entry[1] += seconds
+                entry[2] += points
+                entry[3] = [
+                    old + new for old, new in zip(entry[3], latencies)
+                ]
+
+    @staticmethod
+    def rows(entries):
+        return [
+            {
+                'alias': name,
+                'calls': calls,
+                'seconds': seconds,
+                'latencies': latencies,
+                'points': points
+            }
+            for name, (calls, seconds, points, latencies) in entries.items()
+        ]
+
+    def flush(self, cn, namespace, entries):
+        rows = self.rows(entries)
+        if rows:
+            cn.execute(UPSERTSQL.format(ns=namespace), rows)
+        return len(rows)
@@ -0,0 +1,132 @@
+import json
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import time
+
+from sqlalchemy import event
+
+
+# (timeseries, tracer) of the current context (see timeseries.tracing):
+# the other threads and tasks read untraced
+active = ContextVar('tshistory_alias_tracer', default=(None, None))
+
+
+class tracenode:
+    """Profile of the evaluation of one node
+
+    `seconds`, `queries` and `memory` include those of the children;
+    `combine` and `bounds` are the seconds spent in the combination
+    of the members and in the outliers filtering of the node itself.
+    """
+
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.cached = False
+        self.seconds = 0
+        self.queries = 0
+        self.points = None
+        self.combine = 0
+        self.bounds = 0
+        self.memory = None
+        self.peak = None
+        self.children = []
+
+    def asdict(self):
+        return {
+            'name': self.name,
+            'kind': self.kind,
+            'cached': self.cached,
+            'seconds': self.seconds,
+            'queries': self.queries,
+            'points': self.points,
+            'combine': self.combine,
+            'bounds': self.bounds,
+            'memory': self.memory,
+            'children': [child.asdict() for child in self.children]
+        }
+
+    def show(self, depth=0, printer=print):
+        if self.cached:
+            stats = 'cached'
+        else:
+            stats = (f'{self.seconds:.4f}s {self.queries} queries '
+                     f'combine={self.combine:.4f}s bounds={self.bounds:.4f}s')
+            if self.memory is not None:
+                stats += f' memory={self.memory // 1024}kb'
+        printer('    ' * depth,
+                f'* {self.kind} `{self.name}` {self.points} points {stats}')
+        for child in self.children:
+            child.show(depth + 1, printer)
+
+
+class tracer:
+    """Collect the profile of the alias reads of a timeseries
+
+    The reads are traced one at a time, in the calling thread; the
+    memory is measured when tracemalloc is running.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.thread = threading.get_ident()
+        self.roots = []
+        self.stack = []
+        self.queries = 0
+        event.listen(engine, 'before_cursor_execute', self.count)
+
+    def close(self):
+        event.remove(self.engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        if threading.get_ident() == self.thread:
+            self.queries += 1
+
+    @contextmanager
+    def node(self, name, kind):
+        node = tracenode(name, kind)
+        (self.stack[-1].children if self.stack else self.roots).append(node)
+        self.stack.append(node)
+        memory = tracemalloc.is_tracing()
+        if memory:
+            start = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        queries = self.queries
+        t0 = time()
+        try:
+            yield node
+        finally:
+            node.seconds = time() - t0
+            node.queries = self.queries - queries
+            if memory:
+                # the children reset the peak: take theirs into account
+                node.peak = max(
+                    [tracemalloc.get_traced_memory()[1]] +
+                    [child.peak for child in node.children
+                     if child.peak is not None]
+                )
+                node.memory = node.peak - start
+            self.stack.pop()
+
+    @contextmanager
+    def timed(self, what):
+        t0 = time()
+        try:
+            yield
+        finally:
+            if self.stack:
+                node = self.stack[-1]
+                setattr(node, what, getattr(node, what) + time() - t0)
+
+    def show(self, printer=print):
+        for root in self.roots:
+            root.show(printer=printer)
+
+    def json(self):
+        return json.dumps(
+            [root.asdict() for root in self.roots],
+            indent=2
+        )
@@ -1,35 +1,134 @@
-from sqlalchemy import exists, select
+import asyncio
+import logging
+from bisect import bisect_right
+from contextlib import contextmanager, nullcontext
+from functools import partial
+from time import time
+
+from sqlalchemy import event, exists, select
+from sqlalchemy.engine import Connection, Engine
 from sqlalchemy.dialects.postgresql import insert
 
+import numpy as np
 import pandas as pd
 
 from tshistory.tsio import timeseries as basets
+from tshistory_alias import aio, combine, materialize, stats, trace
+from tshistory_alias.cache import definitioncache, resultcache, filecache
+from tshistory_alias.graph import CLOSURESQL, AliasError, aliasgraph
+from tshistory_alias.plan import align, evaluation, plan, utc
 from tshistory_alias.schema import alias_schema
 
 
-
-class AliasError(Exception):
-    pass
+LOG = logging.getLogger(__name__)
 
 
 class timeseries(basets):
     alias_schema = None
     alias_types = ('priority', 'arithmetic')
+    aliascache = None
+    # seconds between two checks of the definitions generation
+    # (0: at every read, see `_fresh`)
+    definitions_ttl = 1
+    # default size of the thread pool of the alias reads
+    # (None or 1: sequential reads)
+    max_workers = None
+    # asynchronous connections per engine and event loop, and executor
+    # threads reading the leaves of each alias (see `aget`)
+    async_connections = 4
+    async_workers = 4
+    # default value-range pushdown of the priority members
+    # (see plan.evaluation)
+    pushdown = False
+    # default streaming of the arithmetic members (see plan.evaluation)
+    stream = False
+    # read and maintain the materialized aliases (see `materialize`)
+    materialization = False
+    # read statistics stats.collector (see `collect_stats`)
+    collector = None
+    # computed series cache.resultcache (see `cache_results`)
+    resultcache = None
+    # host-wide computed series cache.filecache (see `cache_files`)
+    filecache = None
+
+    def __init__(self, *a, **kw):
+        super().__init__(*a, **kw)
+        self.aliascache = definitioncache()
 
     def type(self, cn, name):
-        # cache-filling
-        base = (f'select alias from "{self.namespace}".{{}} '
-                'where alias = %(name)s '
-                'limit 1')
-        priority = base.format('priority')
-        arith = base.format('arithmetic')
-        if cn.execute(priority, name=name).scalar():
-            kind = 'priority'
-        elif cn.execute(arith, name=name).scalar():
-            kind = 'arithmetic'
-        else:
-            kind = super().type(cn, name)
-        return kind
+        self._fresh(cn)
+        cache = self.aliascache
+        if name in cache.kinds:
+            cache.hits += 1
+            return cache.kinds[name]
+        cache.misses += 1
+        return self.graph(cn, [name]).kind(name)
+
+    def graph(self, cn, names):
+        """Load the whole definition graph of `names` in one query
+
+        The definition cache is filled with every node of the graph,
+        so that the evaluation of the aliases does no further
+        definition query. The kind of the names which are neither
+        aliases nor existing primary series is not remembered: another
+        process may define them later.
+        """
+        epoch = self.aliascache.epoch
+        return self._cache_graph(
+            aliasgraph.load(cn, self.namespace, names), epoch
+        )
+
+    def _cache_graph(self, graph, epoch):
+        cache = self.aliascache
+        if not cache.storable(epoch):
+            return graph
+        for name in graph.nodes():
+            kind = graph.kind(name)
+            if kind in self.alias_types or name in graph.primaries:
+                cache.kinds[name] = kind
+            cache.bounds[name] = graph.bounds.get(name)
+        cache.members.update(graph.members)
+        return graph
+
+    @property
+    def _generationsql(self):
+        return f'select generation from "{self.namespace}".alias_generation'
+
+    def _fresh(self, cn):
+        """Drop the definition cache when the definitions were changed
+        (by any process), checked at most every `definitions_ttl`
+        seconds
+        """
+        cache = self.aliascache
+        if time() - cache.checked < self.definitions_ttl:
+            return
+        cache.seen(cn.execute(self._generationsql).scalar())
+
+    def _defining(self, cn):
+        """Account for a change of the definitions done on `cn`
+
+        The definitions generation is bumped, for all the processes
+        (see `_fresh`). Within a transaction, nothing is stored into
+        the definition cache until its end, when it is cleared.
+        """
+        cn.execute(
+            f'update "{self.namespace}".alias_generation '
+            'set generation = generation + 1'
+        )
+        if not isinstance(cn, Connection) or not cn.in_transaction():
+            return
+        cache = self.aliascache
+        if cn in cache.transactions:
+            return
+        cache.transactions.add(cn)
+
+        def done(conn):
+            if conn in cache.transactions:
+                cache.transactions.discard(conn)
+                cache.clear()
+
+        event.listen(cn, 'commit', done)
+        event.listen(cn, 'rollback', done)
 
     def exists(self, cn, name):
         if self.type(cn, name) in self.alias_types:
@@ -44,106 +143,713 @@ class timeseries(basets):
                 name, serie_type)
             )
 
-        return super().insert(cn, newts, name, author=author, **kw)
+        diff = super().insert(cn, newts, name, author=author, **kw)
+        if diff is not None and len(diff):
+            # before the refresh, which may read the dependents
+            # (and even without entries: a read may be computing one)
+            if self.resultcache is not None or self.filecache is not None:
+                self._drop_results(self.dependents(cn, name))
+            if self.materialization:
+                self._refresh_dependents(cn, name, diff)
+        return diff
 
     def get(self, cn, name, revision_date=None, delta=None,
-            from_value_date=None, to_value_date=None, _keep_nans=False):
+            from_value_date=None, to_value_date=None, _keep_nans=False,
+            max_workers=None, pushdown=None, stream=None):
 
         serie_type = self.type(cn, name)
-        ts = None
-        if serie_type not in self.alias_types:
-            if delta is None:
-                ts = super().get(
-                    cn, name, revision_date=revision_date,
-                    from_value_date=from_value_date,
-                    to_value_date=to_value_date,
-                    _keep_nans=_keep_nans
+        if serie_type in self.alias_types:
+            if self.collector is None:
+                return self._get_alias(
+                    cn, name, revision_date, delta,
+                    from_value_date, to_value_date,
+                    max_workers, pushdown, stream
                 )
-            else:
-                ts = self.staircase(cn, name, delta=delta,
-                                    from_value_date=from_value_date,
-                                    to_value_date=to_value_date
+            t0 = time()
+            ts = self._get_alias(
+                cn, name, revision_date, delta,
+                from_value_date, to_value_date,
+                max_workers, pushdown, stream
+            )
+            if self._record(cn, name, time() - t0, ts):
+                self._flush_due(cn)
+            return ts
+
+        ts = self._get_primary(
+            cn, name, revision_date=revision_date,
+            delta=delta,
+            from_value_date=from_value_date,
+            to_value_date=to_value_date,
+            _keep_nans=_keep_nans
+        )
+        if ts is not None:
+            ts = self.apply_bounds(cn, ts, name)
+
+        return ts
+
+    def _get_alias(self, cn, name, revision_date, delta,
+                   from_value_date, to_value_date,
+                   max_workers, pushdown, stream):
+        if self.resultcache is None and self.filecache is None:
+            return self._compute_alias(
+                cn, name, revision_date, delta,
+                from_value_date, to_value_date,
+                max_workers, pushdown, stream
+            )
+        ts, pending = self._lookup(
+            cn, name, revision_date, delta, from_value_date, to_value_date
+        )
+        if pending is None:
+            return ts
+        ts = self._compute_alias(
+            cn, name, revision_date, delta,
+            from_value_date, to_value_date,
+            max_workers, pushdown, stream
+        )
+        if ts is None:
+            return None
+        return self._store(pending, ts)
+
+    def _lookup(self, cn, name, revision_date, delta,
+                from_value_date, to_value_date, compiled=None):
+        """Look a computed alias up in the result caches
+
+        Returns a (ts, pending) pair: without a cached series,
+        `pending` goes to `_store` with the computed one.
+        """
+        key = (
+            name, revision_date, delta,
+            from_value_date, to_value_date,
+            self.version(cn, name, compiled)
+        )
+        # taken before the computation, see resultcache.put
+        generation = filegeneration = None
+        if self.resultcache is not None:
+            generation = self.resultcache.generation(name)
+            ts = self.resultcache.get(key)
+            if ts is not None:
+                return ts, None
+        if self.filecache is not None:
+            filegeneration = self.filecache.generation(name)
+            ts = self.filecache.get(key, filegeneration)
+            if ts is not None:
+                if self.resultcache is not None:
+                    ts = self.resultcache.put(key, ts, generation)
+                return ts, None
+        return None, (key, generation, filegeneration)
+
+    def _store(self, pending, ts):
+        """Put a computed alias into the result caches (see `_lookup`)"""
+        key, generation, filegeneration = pending
+        if self.filecache is not None:
+            ts = self.filecache.put(key, ts, filegeneration)
+        if self.resultcache is not None:
+            ts = self.resultcache.put(key, ts, generation)
+        return ts
+
+    def _compute_alias(self, cn, name, revision_date, delta,
+                       from_value_date, to_value_date,
+                       max_workers, pushdown, stream):
+        if self.materialization and revision_date is None and delta is None:
+            ts = self._get_materialized(
+                cn, name, from_value_date, to_value_date
+            )
+            if ts is not None:
+                return ts
+        return evaluation(
+            self, cn, revision_date, delta, max_workers, pushdown, stream
+        ).run(name, from_value_date, to_value_date)
+
+    def cache_results(self, maxbytes=256 * 2**20, ttl=300):
+        """Keep the computed alias series in an in-process LRU cache
+        of `maxbytes` bytes
+
+        The cache is invalidated by the inserts into the dependencies
+        and by the definition changes done through this object. The
+        inserts done elsewhere are seen after at most `ttl` seconds
+        (None: never); the definition changes done elsewhere within
+        `definitions_ttl` seconds, since the cache keys hold the
+        definition versions, dropped with the definition cache. The
+        served series have read-only values.
+        """
+        self.resultcache = resultcache(maxbytes, ttl)
+        return self.resultcache
+
+    def cache_files(self, directory, maxbytes=4 * 2**30):
+        """Share the computed alias series between the processes of a
+        host, as memory-mapped files in `directory` (of at most
+        `maxbytes` bytes)
+
+        This tier sits below the in-process one (see `cache_results`)
+        and is invalidated the same way.
+        """
+        self.filecache = filecache(directory, maxbytes)
+        return self.filecache
+
+    def version(self, cn, name, compiled=None):
+        """Digest of the whole definition of an alias (see
+        plan.version), computed from its `compiled` plan if given
+        """
+        def digest():
+            if compiled is None:
+                return plan.compile(self, cn, name).version(self, cn)
+            return compiled.version(self, cn)
+
+        return self.aliascache.lookup(self.aliascache.versions, name, digest)
+
+    def _redefined(self, cn, names):
+        """Drop the cached versions and results of `names` and of
+        their dependents
+        """
+        self._defining(cn)
+        names = set(names)
+        if (self.aliascache.versions or self.resultcache is not None or
+            self.filecache is not None):
+            names.update(
+                alias for alias, in cn.execute(
+                    f'select alias from "{self.namespace}".dependency '
+                    'where serie = any(%(names)s::text[])',
+                    names=list(names)
+                ).fetchall()
+            )
+        for name in names:
+            self.aliascache.versions.pop(name, None)
+        self._drop_results(names)
+
+    def _drop_results(self, names):
+        for cache in (self.resultcache, self.filecache):
+            if cache is not None:
+                cache.invalidate(names)
+
+    # read statistics
+
+    def collect_stats(self, interval=60):
+        """Start collecting per-alias read statistics, flushed into
+        the alias_stats table every `interval` seconds (by the reads,
+        or else by a background thread) and at exit
+        """
+        if self.collector is not None:
+            self.collector.stop()
+        self.collector = stats.collector(interval)
+        self.collector.start(self._flush_pending)
+        return self.collector
+
+    def _record(self, cn, name, seconds, ts):
+        """Record a read, and tell if the statistics are due for a
+        flush
+        """
+        collector = self.collector
+        if collector.engine is None:
+            collector.engine = cn.engine
+        collector.record(name, seconds, 0 if ts is None else len(ts))
+        return collector.due()
+
+    def _flush_pending(self):
+        """Flush the statistics of the timer or at exit, on the
+        engine of the recorded reads
+        """
+        engine = self.collector.engine
+        if engine is not None and self.collector.entries:
+            self._flush_due(engine)
+
+    def _flush_due(self, cn):
+        try:
+            self.flush_stats(cn)
+        except Exception:
+            # never fail the read: the entries wait for the next flush
+            LOG.exception('could not flush the alias statistics')
+
+    def flush_stats(self, cn):
+        """Write the collected statistics, on a connection (and
+        transaction) of its own
+
+        On failure the statistics are kept for the next flush.
+        """
+        if self.collector is None:
+            return 0
+        entries = self.collector.take()
+        try:
+            with cn.engine.begin() as fcn:
+                return self.collector.flush(fcn, self.namespace, entries)
+        except Exception:
+            self.collector.restore(entries)
+            raise
+
+    def alias_stats(self, cn, by='calls', limit=20):
+        """Aliases with the highest `by` (calls, seconds, p95, mean or
+        points) statistic
+
+        The p95 latency is the upper bound of its histogram bucket
+        (see stats.BASE and stats.RATIO).
+        """
+        assert by in ('calls', 'seconds', 'p95', 'mean', 'points')
+        return cn.execute(
+            f'select alias, calls, seconds, seconds / calls as mean, p95, '
+            f'       points / calls as points, updated '
+            f'from "{self.namespace}".alias_stats '
+            f'cross join lateral ({stats.PERCENTILESQL}) as percentile '
+            f'order by {by} desc nulls last, alias '
+            f'limit %(limit)s',
+            base=stats.BASE,
+            ratio=stats.RATIO,
+            percentile=.95,
+            limit=limit
+        ).fetchall()
+
+    @contextmanager
+    def tracing(self, cn):
+        """Profile the reads done within the block
+
+        Yields a trace.tracer, holding one profile tree per read. Only
+        the reads of the calling thread (or task) are traced, and they
+        run sequentially.
+        """
+        tracer = trace.tracer(cn.engine)
+        token = trace.active.set((self, tracer))
+        try:
+            yield tracer
+        finally:
+            trace.active.reset(token)
+            tracer.close()
+
+    @property
+    def tracer(self):
+        """The trace.tracer of the current thread or task, if any"""
+        tsh, tracer = trace.active.get()
+        return tracer if tsh is self else None
+
+    async def aget(self, engine, name, revision_date=None, delta=None,
+                   from_value_date=None, to_value_date=None):
+        """Coroutine version of `get`, for use within an event loop
+
+        It needs an engine. The definitions and the materializations
+        are read on the asynchronous connections of the engine for the
+        running loop (see `aio.pooled`). tshistory being synchronous,
+        the primary series are read on the default executor of the
+        loop, by at most `async_workers` threads per alias, on
+        connections of the engine pool. The caches, the
+        materializations and the statistics are used as with `get`;
+        the reads are neither pushed down nor streamed.
+        """
+        loop = asyncio.get_running_loop()
+        acn = aio.pooled(engine, self.async_connections)
+        cache = self.aliascache
+        if time() - cache.checked >= self.definitions_ttl:
+            rows = await acn.execute(self._generationsql)
+            cache.seen(rows[0].generation)
+        graph = None
+        if not self._cached(name):
+            epoch = cache.epoch
+            graph = self._cache_graph(
+                await aliasgraph.aload(acn, self.namespace, [name]),
+                epoch
+            )
+        kind = cache.kinds[name] if graph is None else graph.kind(name)
+        if kind not in self.alias_types:
+            return await loop.run_in_executor(
+                None,
+                partial(
+                    self.get, engine, name, revision_date, delta,
+                    from_value_date, to_value_date
                 )
+            )
+        compiled = plan.compile(self, engine, name, graph)
+        t0 = time()
+        ts = await self._aget_alias(
+            acn, engine, compiled, revision_date, delta,
+            from_value_date, to_value_date
+        )
+        if (self.collector is not None and
+            self._record(engine, name, time() - t0, ts)):
+            await loop.run_in_executor(None, self._flush_due, engine)
+        return ts
 
-        elif serie_type == 'priority':
-            ts, _ = self.get_priority(
-                cn, name, revision_date,
-                delta=delta,
-                from_value_date=from_value_date,
-                to_value_date=to_value_date,
+    def _cached(self, name):
+        """Tell if the whole definition graph of `name` is in the
+        definition cache
+        """
+        cache = self.aliascache
+        seen = set()
+        stack = [name]
+        while stack:
+            node = stack.pop()
+            if node in seen:
+                continue
+            seen.add(node)
+            if node not in cache.kinds or node not in cache.bounds:
+                return False
+            if cache.kinds[node] in self.alias_types:
+                if node not in cache.members:
+                    return False
+                stack.extend(row.serie for row in cache.members[node])
+        return True
+
+    async def _aget_alias(self, acn, engine, compiled, revision_date, delta,
+                          from_value_date, to_value_date):
+        """Coroutine version of `_get_alias`"""
+        if self.resultcache is None and self.filecache is None:
+            return await self._acompute_alias(
+                acn, engine, compiled, revision_date, delta,
+                from_value_date, to_value_date
             )
-        elif serie_type == 'arithmetic':
-            ts = self.get_arithmetic(
-                cn, name, revision_date,
-                delta=delta,
+        loop = asyncio.get_running_loop()
+        # the file cache and the version computation block
+        ts, pending = await loop.run_in_executor(
+            None,
+            partial(
+                self._lookup, engine, compiled.name, revision_date, delta,
+                from_value_date, to_value_date, compiled
+            )
+        )
+        if pending is None:
+            return ts
+        ts = await self._acompute_alias(
+            acn, engine, compiled, revision_date, delta,
+            from_value_date, to_value_date
+        )
+        if ts is None:
+            return None
+        return await loop.run_in_executor(None, self._store, pending, ts)
+
+    async def _acompute_alias(self, acn, engine, compiled, revision_date,
+                              delta, from_value_date, to_value_date):
+        """Coroutine version of `_compute_alias`"""
+        if self.materialization and revision_date is None and delta is None:
+            rows = await acn.execute(self._materializedsql, alias=compiled.name)
+            if rows:
+                ts = await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    partial(
+                        self._materialized, engine, compiled.name, rows[0],
+                        from_value_date, to_value_date, compiled
+                    )
+                )
+                if ts is not None:
+                    return ts
+        return await evaluation(
+            self, engine, revision_date, delta, self.async_workers
+        ).arun(compiled.name, from_value_date, to_value_date, compiled)
+
+    async def aget_many(self, engine, names, **kw):
+        """Concurrently read several series, returned in a list"""
+        return await asyncio.gather(*[
+            self.aget(engine, name, **kw)
+            for name in names
+        ])
+
+    def _get_primary(self, cn, name, revision_date=None, delta=None,
+                     from_value_date=None, to_value_date=None,
+                     _keep_nans=False):
+        if delta is None:
+            return super().get(
+                cn, name, revision_date=revision_date,
                 from_value_date=from_value_date,
                 to_value_date=to_value_date,
+                _keep_nans=_keep_nans
             )
+        return self.staircase(cn, name, delta=delta,
+                              from_value_date=from_value_date,
+                              to_value_date=to_value_date
+        )
 
-        if ts is not None:
-            ts = self.apply_bounds(cn, ts, name)
+    def _extents(self, cn, names):
+        """First and last value dates of primary series, as a dict
+        (None when unknown)
 
-        return ts
+        They are the bounds of the stored snapshot chunks of the
+        series (a superset of the extent of their latest version),
+        read with one query for all the series.
+        """
+        tables = self._tables(cn, names)
+        out = dict.fromkeys(names)
+        known = [name for name in names if name in tables]
+        if not known:
+            return out
+        params = {}
+        selects = []
+        for idx, name in enumerate(known):
+            params[f'name{idx}'] = name
+            selects.append(
+                f'select %(name{idx})s as name, '
+                f'       min(cstart) as first, max(cend) as last '
+                f'from "{self.namespace}.snapshot"."{tables[name][0]}"'
+            )
+        for row in cn.execute(' union all '.join(selects), **params).fetchall():
+            if row.first is None:
+                continue
+            first, last = pd.Timestamp(row.first), pd.Timestamp(row.last)
+            if tables[row.name][1]:
+                first, last = first.tz_localize('UTC'), last.tz_localize('UTC')
+            out[row.name] = first, last
+        return out
+
+    def _tables(self, cn, names):
+        """Storage table and tz-awareness of the existing primary
+        series among `names` (cached: they do not change)
+        """
+        tables = self.aliascache.tables
+        missing = [name for name in names if name not in tables]
+        if missing:
+            for row in cn.execute(
+                    f'select seriename, table_name, metadata '
+                    f'from "{self.namespace}".registry '
+                    'where seriename = any(%(names)s::text[])',
+                    names=missing
+            ).fetchall():
+                tables[row.seriename] = (
+                    row.table_name,
+                    bool((row.metadata or {}).get('tzaware'))
+                )
+        return tables
+
+    def bounds(self, cn, name):
+        return self.aliascache.lookup(
+            self.aliascache.bounds, name,
+            lambda: self._bounds(cn, name)
+        )
 
     def apply_bounds(self, cn, ts, name):
-        sql = (f'select min, max from "{self.namespace}".outliers '
-               'where serie = %(name)s')
-        mini_maxi = cn.execute(
-            sql,
-            name=name
-        ).fetchone()
+        mini_maxi = self.bounds(cn, name)
         if not mini_maxi:
             return ts
 
         mini, maxi = mini_maxi
+        mask = None
         if mini is not None and not pd.isnull(mini):
-            ts = ts[ts >= mini]
+            mask = ts.values >= mini
         if maxi is not None and not pd.isnull(maxi):
-            ts = ts[ts <= maxi]
+            below = ts.values <= maxi
+            mask = below if mask is None else mask & below
+        if mask is None:
+            return ts
 
-        return ts
+        return ts[mask]
 
-    def get_priority(self, cn, alias,
-                     revision_date=None,
-                     delta=None,
-                     from_value_date=None,
-                     to_value_date=None):
+    def preload_bounds(self, cn, names=None):
+        """Load the outliers bounds of `names` (all by default) into
+        the definition cache, with one query
+        """
+        epoch = self.aliascache.epoch
+        sql = f'select serie, min, max from "{self.namespace}".outliers'
+        if names is None:
+            rows = cn.execute(sql).fetchall()
+        else:
+            rows = cn.execute(
+                sql + ' where serie = any(%(names)s::text[])',
+                names=list(names)
+            ).fetchall()
+        if not self.aliascache.storable(epoch):
+            return
+        for name in names or ():
+            self.aliascache.bounds[name] = None
+        for row in rows:
+            self.aliascache.bounds[row.serie] = (row.min, row.max)
 
-        res = cn.execute(
-            f'select serie, prune, coefficient '
-            f'from "{self.namespace}".priority as prio '
-            f'where prio.alias = %(alias)s '
-            f'order by priority desc',
-            alias=alias
+    def _bounds(self, cn, name):
+        sql = (f'select min, max from "{self.namespace}".outliers '
+               'where serie = %(name)s')
+        mini_maxi = cn.execute(
+            sql,
+            name=name
+        ).fetchone()
+        if mini_maxi is None:
+            return None
+        return tuple(mini_maxi)
+
+    def _members(self, cn, alias, kind):
+        return self.aliascache.lookup(
+            self.aliascache.members, alias,
+            lambda: self._load_members(cn, alias, kind)
         )
 
-        ts_values = pd.Series()
-        ts_origins = pd.Series()
+    def _load_members(self, cn, alias, kind):
+        if kind == 'priority':
+            sql = (f'select serie, prune, coefficient '
+                   f'from "{self.namespace}".priority as prio '
+                   f'where prio.alias = %(alias)s '
+                   f'order by priority desc')
+        else:
+            sql = (f'select serie, fillopt, coefficient '
+                   f'from "{self.namespace}".arithmetic '
+                   f'where alias = %(alias)s')
+        return cn.execute(sql, alias=alias).fetchall()
 
-        for row in res.fetchall():
-            name = row.serie
-            prune = row.prune
-            ts = self.get(
+    def get_history(self, cn, name,
+                    from_insertion_date=None, to_insertion_date=None,
+                    from_value_date=None, to_value_date=None,
+                    **kw):
+        if self.type(cn, name) not in self.alias_types:
+            return super().get_history(
                 cn, name,
-                revision_date=revision_date,
-                delta=delta,
+                from_insertion_date=from_insertion_date,
+                to_insertion_date=to_insertion_date,
                 from_value_date=from_value_date,
-                to_value_date=to_value_date
+                to_value_date=to_value_date,
+                **kw
             )
-            if ts is None:
-                continue
+        unsupported = [key for key, value in kw.items() if value]
+        if unsupported:
+            raise AliasError(
+                f'{", ".join(unsupported)} not supported for alias {name}'
+            )
+        return self.get_revisions(
+            cn, name,
+            from_insertion_date=from_insertion_date,
+            to_insertion_date=to_insertion_date,
+            from_value_date=from_value_date,
+            to_value_date=to_value_date
+        )
+
+    def get_revisions(self, cn, name, revision_dates=None,
+                      from_insertion_date=None, to_insertion_date=None,
+                      from_value_date=None, to_value_date=None):
+        """Values of a series at several revision dates, as a dict
 
-            if ts.dtype != 'O' and row.coefficient != 1:
-                ts = ts * row.coefficient
+        The revision dates default to the insertion dates of the
+        leaves between `from_insertion_date` and `to_insertion_date`.
+        The version history of each leaf is read once. The series is
+        computed only at the revision dates where some leaf version
+        changes; the other revision dates share the previous result.
+        Dates where the series does not exist yet are left out.
+        """
+        compiled = plan.compile(self, cn, name)
+        leaves = compiled.leaves()
+        if revision_dates is not None:
+            revision_dates = sorted(revision_dates, key=utc)
+            if not revision_dates:
+                return {}
+            from_insertion_date = revision_dates[0]
+            to_insertion_date = revision_dates[-1]
 
-            ts_id = pd.Series(name, index=ts.index)
+        versions = {}
+        insertions = set()
+        for leaf in leaves:
+            versions[leaf], idates = self._versions(
+                cn, leaf, from_insertion_date, to_insertion_date,
+                from_value_date, to_value_date
+            )
+            insertions.update(idates)
+        if revision_dates is None:
+            revision_dates = sorted(insertions)
+        idates = {
+            leaf: [idate for idate, _ in versions[leaf]]
+            for leaf in leaves
+        }
+
+        out = {}
+        previous = None
+        for revdate in revision_dates:
+            revdate_utc = utc(revdate)
+            current = tuple(
+                bisect_right(idates[leaf], revdate_utc) - 1
+                for leaf in leaves
+            )
+            if current != previous:
+                previous = current
+                ev = evaluation(
+                    self, cn, revision_date=revdate,
+                    max_workers=1, pushdown=False
+                )
+                for leaf, idx in zip(leaves, current):
+                    ev.memo[ev.key(leaf, from_value_date, to_value_date)] = (
+                        versions[leaf][idx][1] if idx >= 0 else None
+                    )
+                try:
+                    ts = ev.run(name, from_value_date, to_value_date)
+                except AliasError:
+                    # a member does not exist yet
+                    ts = None
+            if ts is not None:
+                out[revdate] = ts
+        return out
+
+    def get_staircases(self, cn, name, deltas,
+                       from_value_date=None, to_value_date=None):
+        """Staircases of a series for several horizons, as a frame
+        with one column per delta
+
+        The version history of each leaf is read once (each version
+        cut to what the shortest horizon needs); the staircases of all
+        the horizons are built out of it and then combined per
+        horizon.
+        """
+        compiled = plan.compile(self, cn, name)
+        deltabefore = -min(deltas) if deltas else None
+        histories = {
+            leaf: super(timeseries, self).get_history(
+                cn, leaf,
+                from_value_date=from_value_date,
+                to_value_date=to_value_date,
+                deltabefore=deltabefore
+            )
+            for leaf in compiled.leaves()
+        }
+        columns = {}
+        for delta in deltas:
+            ev = evaluation(
+                self, cn, delta=delta,
+                max_workers=1, pushdown=False
+            )
+            for leaf, history in histories.items():
+                ts = None
+                if history is not None:
+                    ts = self.apply_bounds(
+                        cn, combine.staircase(leaf, history, delta), leaf
+                    )
+                ev.memo[ev.key(leaf, from_value_date, to_value_date)] = ts
+            columns[delta] = ev.run(name, from_value_date, to_value_date)
+        return pd.DataFrame(columns, columns=list(deltas))
 
-            ts_values = self._apply_priority(ts_values, ts, prune)
-            ts_origins = self._apply_priority(ts_origins, ts_id, prune)
+    def _versions(self, cn, name, from_insertion_date, to_insertion_date,
+                  from_value_date, to_value_date):
+        """Successive versions of a primary series (bounds applied)
 
-            ts_values.name = alias
-            ts_origins.name = alias
+        Returns a list of (insertion date, series) pairs, starting
+        with the version current at `from_insertion_date`, and the
+        insertion dates of the period.
+        """
+        versions = {}
+        if from_insertion_date is not None:
+            ts = self._get_primary(
+                cn, name, revision_date=from_insertion_date,
+                from_value_date=from_value_date,
+                to_value_date=to_value_date
+            )
+            if ts is not None:
+                versions[utc(from_insertion_date)] = ts
+        history = super().get_history(
+            cn, name,
+            from_insertion_date=from_insertion_date,
+            to_insertion_date=to_insertion_date,
+            from_value_date=from_value_date,
+            to_value_date=to_value_date
+        ) or {}
+        idates = [utc(idate) for idate in history]
+        versions.update(zip(idates, history.values()))
+        return [
+            (idate, self.apply_bounds(cn, versions[idate], name))
+            for idate in sorted(versions)
+        ], idates
 
+    def get_priority(self, cn, alias,
+                     revision_date=None,
+                     delta=None,
+                     from_value_date=None,
+                     to_value_date=None):
+        ev = evaluation(self, cn, revision_date, delta)
+        compiled = ev.prepare(alias, from_value_date, to_value_date)
+        ts_values, ts_codes = ev.priority(
+            compiled, alias, from_value_date, to_value_date, origins=True
+        )
+        names = np.array(
+            [row.serie for row in compiled.members[alias]],
+            dtype='O'
+        )
+        ts_origins = pd.Series(
+            names[ts_codes.values],
+            index=ts_codes.index,
+            name=alias
+        )
         return ts_values, ts_origins
 
     def get_arithmetic(self, cn, alias,
@@ -151,66 +857,298 @@ class timeseries(basets):
                         delta=None,
                         from_value_date=None,
                         to_value_date=None):
-        res = cn.execute(
-            f'select serie, fillopt, coefficient '
-            f'from "{self.namespace}".arithmetic '
-            f'where alias = %(alias)s',
+        ev = evaluation(self, cn, revision_date, delta)
+        compiled = ev.prepare(alias, from_value_date, to_value_date)
+        return ev.arithmetic(compiled, alias, from_value_date, to_value_date)
+
+    # materialization
+
+    def materialize(self, cn, alias):
+        """Compute and store the current value of an alias
+
+        Until one of its dependencies changes, `get` on the alias (at
+        the latest revision, without delta) reads it back.
+
+        This is opt-in: the stored values are only read and kept up to
+        date by the `timeseries` having `materialization` set, which
+        must be the case of all those writing to the namespace.
+        """
+        compiled = plan.compile(self, cn, alias)
+        if alias not in compiled.members:
+            raise AliasError(f'{alias} is not an alias')
+        ts = evaluation(self, cn).run(alias)
+        if ts.dtype == 'O':
+            raise AliasError(f'{alias} is not numeric')
+        tz, idx, vals = materialize.encode(ts)
+        cn.execute(
+            f'insert into "{self.namespace}".materialized '
+            '(alias, version, stale, tz, idx, vals, computed) '
+            'values (%(alias)s, %(version)s, false, %(tz)s, %(idx)s, %(vals)s, now()) '
+            'on conflict (alias) do update '
+            'set version = %(version)s, stale = false, tz = %(tz)s, '
+            '    idx = %(idx)s, vals = %(vals)s, computed = now()',
+            alias=alias,
+            version=self.version(cn, alias),
+            tz=tz,
+            idx=idx,
+            vals=vals
+        )
+        return ts
+
+    def dematerialize(self, cn, alias):
+        cn.execute(
+            f'delete from "{self.namespace}".materialized '
+            'where alias = %(alias)s',
             alias=alias
         )
 
-        first_iteration = True
-        df_result = None
-        ts_with_fillopt = {}
+    def materialized(self, cn):
+        """List the materialized aliases"""
+        return cn.execute(
+            f'select alias, version, stale, computed, '
+            f'       length(vals) / 8 as points '
+            f'from "{self.namespace}".materialized '
+            f'order by alias'
+        ).fetchall()
 
-        for row in res.fetchall():
-            ts = self.get(
-                cn, row.serie,
-                revision_date=revision_date,
-                delta=delta,
-                from_value_date=from_value_date,
-                to_value_date=to_value_date
+    def refresh_materialized(self, cn, aliases=None):
+        """Recompute the given (by default: the stale) materializations"""
+        if aliases is None:
+            aliases = [
+                alias for alias, in cn.execute(
+                    f'select alias from "{self.namespace}".materialized '
+                    'where stale'
+                ).fetchall()
+            ]
+        for alias in aliases:
+            self.materialize(cn, alias)
+        return aliases
+
+    @property
+    def _materializedsql(self):
+        return (
+            f'select mat.version, mat.tz, mat.idx, mat.vals, gen.generation '
+            f'from "{self.namespace}".materialized as mat, '
+            f'     "{self.namespace}".alias_generation as gen '
+            'where mat.alias = %(alias)s and not mat.stale'
+        )
+
+    def _get_materialized(self, cn, alias, from_value_date, to_value_date):
+        row = cn.execute(self._materializedsql, alias=alias).fetchone()
+        if row is None:
+            return None
+        return self._materialized(
+            cn, alias, row, from_value_date, to_value_date
+        )
+
+    def _materialized(self, cn, alias, row, from_value_date, to_value_date,
+                      compiled=None):
+        """Serve the materialization `row` of `alias` if it matches the
+        current definitions (None otherwise)
+        """
+        # compare with the current definitions: the memoized version
+        # goes if they were changed anywhere
+        epoch = self.aliascache.epoch
+        self.aliascache.seen(row.generation)
+        if compiled is not None and self.aliascache.epoch != epoch:
+            # `compiled` may predate the change
+            return None
+        # the definition may have been changed with the flag off
+        if row.version != self.version(cn, alias, compiled):
+            return None
+        ts = materialize.decode(alias, row.tz, row.idx, row.vals)
+        return materialize.window(ts, from_value_date, to_value_date)
+
+    def _refresh_dependents(self, cn, name, diff):
+        """Patch the materializations depending on `name` over the
+        value-date span of `diff`
+
+        Those which cannot be patched are marked stale.
+        """
+        rows = cn.execute(
+            f'select alias, version, tz, idx, vals '
+            f'from "{self.namespace}".materialized '
+            'where not stale and alias in ('
+            f'  select alias from "{self.namespace}".dependency '
+            '   where serie = %(name)s'
+            ')',
+            name=name
+        ).fetchall()
+        stale = []
+        for row in rows:
+            # a failed patch must not fail the insert: within a
+            # transaction, a savepoint keeps it usable
+            savepoint = (
+                cn.begin_nested()
+                if isinstance(cn, Connection) and cn.in_transaction()
+                else nullcontext()
+            )
+            try:
+                with savepoint:
+                    patched = self._patch_materialized(cn, row, name, diff)
+            except Exception:
+                LOG.exception('cannot patch materialized %s', row.alias)
+                patched = False
+            if not patched:
+                stale.append(row.alias)
+        if stale:
+            cn.execute(
+                f'update "{self.namespace}".materialized '
+                'set stale = true '
+                'where alias = any(%(aliases)s::text[])',
+                aliases=stale
             )
-            if ts is None:
-                raise AliasError(
-                    f'{row.serie} is needed to calculate {alias} and does not exist'
-                )
 
-            if row.fillopt:
-                ts_with_fillopt[ts.name] = row.fillopt
+    def _patch_materialized(self, cn, row, leaf, diff):
+        compiled = plan.compile(self, cn, row.alias)
+        if row.version != self.version(cn, row.alias):
+            return False
+        span = compiled.span(
+            self, cn, leaf, diff.index.min(), diff.index.max()
+        )
+        if span is None:
+            return False
+        readfrom, start, end = span
+        fresh = materialize.window(
+            evaluation(self, cn).run(row.alias, readfrom, end),
+            start, end
+        )
+        ts = materialize.patch(
+            materialize.decode(row.alias, row.tz, row.idx, row.vals),
+            fresh, start, end
+        )
+        tz, idx, vals = materialize.encode(ts)
+        cn.execute(
+            f'update "{self.namespace}".materialized '
+            'set tz = %(tz)s, idx = %(idx)s, vals = %(vals)s, '
+            '    computed = now() '
+            'where alias = %(alias)s',
+            alias=row.alias,
+            tz=tz,
+            idx=idx,
+            vals=vals
+        )
+        return True
 
-            if first_iteration:
-                if row.coefficient != 1:
-                    ts = ts * row.coefficient
-                df_result = ts.to_frame()
-                first_iteration = False
-                continue
+    def _previous(self, cn, name, stamp, count):
+        """Value date of the `count`-th point of `name` before `stamp`
+        (None if there are not so many, or if they cannot be found
+        with a bounded read)
 
-            if row.coefficient != 1:
-                ts = ts * row.coefficient
-            df_result = df_result.join(ts, how='outer')
+        The read window goes back from `stamp`, doubling until it
+        holds enough points or reaches the start of the series. The
+        windows are evaluated directly: they are not worth caching,
+        nor counted in the statistics, and a materialization being
+        patched must not be read.
+        """
+        compiled = plan.compile(self, cn, name)
+        if compiled.windowed(name):
+            # a window could change the values of an alias (prune)
+            return None
+        extent = evaluation(self, cn).extent(compiled, name)
+        if extent is None:
+            return None
+        first = extent[0]
+        stamp = pd.Timestamp(stamp)
+        lookback = pd.Timedelta(days=1)
+        while True:
+            start = stamp - lookback
+            ts = evaluation(self, cn).run(name, start, stamp)
+            if ts is not None and len(ts):
+                index = ts.index[ts.index < align(stamp, ts.index[0])]
+                if len(index) >= count:
+                    return index[-count]
+            if align(start, first) <= first:
+                return None
+            lookback *= 2
 
-        for ts, fillopt in ts_with_fillopt.items():
-            if fillopt.startswith('fill='):
-                filler = float(fillopt.split('=')[1])
-                df_result[ts] = df_result[ts].fillna(filler)
-                continue
-            for method in fillopt.split(','):
-                df_result[ts] = df_result[ts].fillna(method=method.strip())
+    def _stale_dependents(self, cn, names, inclusive=False):
+        """Mark stale the materializations depending on `names`"""
+        if not self.materialization:
+            # the version check of the reads covers the definitions
+            return
+        sql = (
+            f'update "{self.namespace}".materialized '
+            'set stale = true '
+            'where not stale and (alias in ('
+            f'  select alias from "{self.namespace}".dependency '
+            '   where serie = any(%(names)s::text[])'
+            ')'
+        )
+        if inclusive:
+            sql += ' or alias = any(%(names)s::text[])'
+        cn.execute(sql + ')', names=list(names))
 
-        df_result = df_result.dropna()
+    # dependencies
 
-        ts_result = df_result.sum(axis=1)
-        ts_result.name = alias
+    def dependents(self, cn, name, transitive=True):
+        """Aliases depending on `name` (directly or, with `transitive`,
+        through other aliases)
+        """
+        if transitive:
+            sql = (f'select alias from "{self.namespace}".dependency '
+                   'where serie = %(name)s')
+        else:
+            sql = (f'select alias from "{self.namespace}".priority '
+                   'where serie = %(name)s '
+                   'union '
+                   f'select alias from "{self.namespace}".arithmetic '
+                   'where serie = %(name)s')
+        return sorted(
+            alias for alias, in cn.execute(sql, name=name).fetchall()
+        )
 
-        return ts_result
+    def dependencies(self, cn, name, transitive=True):
+        """Series `name` depends on (directly or, with `transitive`,
+        through other aliases)
+        """
+        if transitive:
+            sql = (f'select serie from "{self.namespace}".dependency '
+                   'where alias = %(name)s')
+        else:
+            sql = (f'select serie from "{self.namespace}".priority '
+                   'where alias = %(name)s '
+                   'union '
+                   f'select serie from "{self.namespace}".arithmetic '
+                   'where alias = %(name)s')
+        return sorted(
+            serie for serie, in cn.execute(sql, name=name).fetchall()
+        )
 
-    def _apply_priority(self, ts_result, ts_new, remove, index=None):
-        if index is not None:
-            ts_new = ts_new[index]
-        if remove:
-            ts_new = ts_new[:-remove]
-        combine = self.patch(ts_result, ts_new)
-        return combine
+    def _update_dependencies(self, cn, aliases):
+        """Recompute the closure rows of `aliases` and of their
+        dependents
+        """
+        aliases = list(aliases) + [
+            alias for alias, in cn.execute(
+                f'select distinct alias from "{self.namespace}".dependency '
+                'where serie = any(%(aliases)s::text[])',
+                aliases=list(aliases)
+            ).fetchall()
+        ]
+        cn.execute(
+            f'delete from "{self.namespace}".dependency '
+            'where alias = any(%(aliases)s::text[])',
+            aliases=aliases
+        )
+        cn.execute(
+            CLOSURESQL.format(ns=self.namespace),
+            aliases=aliases
+        )
+
+    def rebuild_dependencies(self, cn):
+        """Recompute the whole dependency closure"""
+        cn.execute(f'delete from "{self.namespace}".dependency')
+        cn.execute(
+            CLOSURESQL.format(ns=self.namespace),
+            aliases=[
+                alias for alias, in cn.execute(
+                    f'select alias from "{self.namespace}".priority '
+                    'union '
+                    f'select alias from "{self.namespace}".arithmetic'
+                ).fetchall()
+            ]
+        )
 
     # alias definition/construction
 
@@ -229,20 +1167,56 @@ class timeseries(basets):
             min=min,
             max=max
         )
+        self.aliascache.bounds.pop(name, None)
+        self._redefined(cn, [name])
         print('insert {} in outliers table'.format(name))
 
+    def remove_alias(self, cn, kind, alias):
+        self._stale_dependents(cn, [alias], inclusive=True)
+        cn.execute(f'delete from "{self.namespace}".{kind} '
+                   'where alias = %(alias)s',
+                   alias=alias)
+        self._redefined(cn, [alias])
+        self._update_dependencies(cn, [alias])
+        self.aliascache.invalidate(alias)
+
+    def reset_aliases(self, cn, tables):
+        self._defining(cn)
+        for table in tables:
+            cn.execute(f'delete from "{self.namespace}"."{table}"')
+        if self.materialization:
+            cn.execute(
+                f'update "{self.namespace}".materialized set stale = true'
+            )
+        self.rebuild_dependencies(cn)
+        self.aliascache.clear()
+        for cache in (self.resultcache, self.filecache):
+            if cache is not None:
+                cache.clear()
+
     def _handle_conflict(self, cn, alias, override):
         kind = self.type(cn, alias)
         if kind in ('arithmetic', 'priority'):
             if override:
                 print('overriding serie {} ({})'.format(alias, kind))
-                cn.execute(f'delete from "tsh".{kind} as al where al.alias = %(alias)s',
+                self._defining(cn)
+                cn.execute(f'delete from "{self.namespace}".{kind} as al '
+                           'where al.alias = %(alias)s',
                            {'alias': alias})
+                self.aliascache.invalidate(alias)
         elif self.exists(cn, alias):
             print('{} serie {} already exists'.format(kind, alias))
             return False
         return True
 
+    def _defined(self, cn, aliases):
+        """Account for new definitions of `aliases`"""
+        self._update_dependencies(cn, aliases)
+        self._redefined(cn, aliases)
+        for alias in aliases:
+            self.aliascache.invalidate(alias)
+        self._stale_dependents(cn, aliases, inclusive=True)
+
     def build_priority(self, cn, alias, names, map_prune=None, map_coef=None, override=False):
         if not self._handle_conflict(cn, alias, override):
             return
@@ -263,6 +1237,7 @@ class timeseries(basets):
                    '(alias, serie, priority, coefficient, prune) '
                    'values (%(alias)s, %(serie)s, %(priority)s, %(coef)s, %(prune)s)')
             cn.execute(sql, **values)
+        self._defined(cn, [alias])
 
     def build_arithmetic(self, cn, alias, map_coef, map_fillopt=None, override=False):
         if not self._handle_conflict(cn, alias, override):
@@ -282,3 +1257,154 @@ class timeseries(basets):
                    '(alias, serie, coefficient, fillopt) '
                    'values (%(alias)s, %(serie)s, %(coef)s, %(fillopt)s)')
             cn.execute(sql, **values)
+        self._defined(cn, [alias])
+
+    # bulk registration
+
+    def _definable(self, cn, aliases, override):
+        """Split `aliases` into those to define and those to skip
+
+        Names of primary series are skipped, as are existing aliases
+        unless `override` is set, in which case their definitions are
+        deleted (one statement per table).
+        """
+        aliases = list(aliases)
+        existing = {
+            alias for alias, in cn.execute(
+                f'select alias from "{self.namespace}".priority '
+                'where alias = any(%(aliases)s::text[]) '
+                'union '
+                f'select alias from "{self.namespace}".arithmetic '
+                'where alias = any(%(aliases)s::text[])',
+                aliases=aliases
+            ).fetchall()
+        }
+        skipped = {
+            name for name, in cn.execute(
+                f'select seriename from "{self.namespace}".registry '
+                'where seriename = any(%(aliases)s::text[])',
+                aliases=aliases
+            ).fetchall()
+        }
+        if override and existing:
+            self._defining(cn)
+            for table in ('priority', 'arithmetic'):
+                cn.execute(
+                    f'delete from "{self.namespace}".{table} '
+                    'where alias = any(%(aliases)s::text[])',
+                    aliases=list(existing)
+                )
+        else:
+            skipped |= existing
+        return (
+            [alias for alias in aliases if alias not in skipped],
+            sorted(skipped)
+        )
+
+    def register_priorities(self, cn, df, override=False):
+        """Bulk version of `build_priority`, for a frame with alias,
+        serie, priority, coefficient and prune columns
+
+        Returns a dict of statistics (aliases and rows written,
+        skipped aliases, elapsed seconds).
+        """
+        t0 = time()
+        df = df[df['alias'].notnull()]
+        aliases, skipped = self._definable(
+            cn, df['alias'].unique().tolist(), override
+        )
+        rows = []
+        defined = df[df['alias'].isin(aliases)]
+        for alias, group in defined.groupby('alias', sort=False):
+            group = group.sort_values(by='priority', kind='mergesort')
+            for priority, row in enumerate(group.itertuples()):
+                rows.append({
+                    'alias': alias,
+                    'serie': row.serie,
+                    'priority': priority,
+                    'coef': 1 if pd.isnull(row.coefficient) else float(row.coefficient),
+                    'prune': None if pd.isnull(row.prune) else int(row.prune)
+                })
+        if rows:
+            cn.execute(
+                f'insert into "{self.namespace}".priority '
+                '(alias, serie, priority, coefficient, prune) '
+                'values (%(alias)s, %(serie)s, %(priority)s, %(coef)s, %(prune)s)',
+                rows
+            )
+        self._defined(cn, aliases)
+        return {
+            'aliases': len(aliases),
+            'rows': len(rows),
+            'skipped': skipped,
+            'seconds': time() - t0
+        }
+
+    def register_arithmetic(self, cn, df, override=False):
+        """Bulk version of `build_arithmetic`, for a frame with alias,
+        serie, coefficient and fillopt columns
+
+        Returns a dict of statistics, as `register_priorities`.
+        """
+        t0 = time()
+        df = df[df['alias'].notnull()]
+        aliases, skipped = self._definable(
+            cn, df['alias'].unique().tolist(), override
+        )
+        rows = []
+        defined = df[df['alias'].isin(aliases)]
+        for alias, group in defined.groupby('alias', sort=False):
+            # like build_arithmetic: one row per member
+            group = group.drop_duplicates('serie', keep='last')
+            for row in group.itertuples():
+                rows.append({
+                    'alias': alias,
+                    'serie': row.serie,
+                    'coef': float(row.coefficient),
+                    'fillopt': None if pd.isnull(row.fillopt) else row.fillopt
+                })
+        if rows:
+            cn.execute(
+                f'insert into "{self.namespace}".arithmetic '
+                '(alias, serie, coefficient, fillopt) '
+                'values (%(alias)s, %(serie)s, %(coef)s, %(fillopt)s)',
+                rows
+            )
+        self._defined(cn, aliases)
+        return {
+            'aliases': len(aliases),
+            'rows': len(rows),
+            'skipped': skipped,
+            'seconds': time() - t0
+        }
+
+    def register_outliers(self, cn, df):
+        """Bulk version of `add_bounds`, for a frame with serie, min and
+        max columns
+        """
+        t0 = time()
+        rows = [
+            {
+                'serie': row.serie,
+                'min': None if pd.isnull(row.min) else float(row.min),
+                'max': None if pd.isnull(row.max) else float(row.max)
+            }
+            for row in df.itertuples()
+            if not (pd.isnull(row.min) and pd.isnull(row.max))
+        ]
+        if rows:
+            cn.execute(
+                f'insert into "{self.namespace}".outliers '
+                '(serie, min, max) '
+                'values (%(serie)s, %(min)s, %(max)s) '
+                'on conflict (serie) do update '
+                'set min = excluded.min, max = excluded.max',
+                rows
+            )
+        for row in rows:
+            self.aliascache.bounds.pop(row['serie'], None)
+        self._redefined(cn, [row['serie'] for row in rows])
+        return {
+            'rows': len(rows),
+            'seconds': time() - t0
+        }